@@ -1,5 +1,8 @@
 '''
-This script generates a big pixmap from all the tiles in the subdirs
+This script compiles the tiles in the subdirs into the big pixmap of the theme, and the mask
+of its transparent pixels, so that loading the theme needs no work per pixel.
+
+Run it from the pixmaps directory.
 
 Author: Philippe Fremy
 License: Gnu GPL (see fname LICENSE)
@@ -9,36 +12,62 @@ import sys
 if __name__ == '__main__':
     sys.path.append('..')
 
-from PyQt5.QtGui import QImage
+from PyQt5.QtGui import QImage, QPainter
+
+from src.kl_enum import pix_list, tile_list, TILE_SIZE, TILE_FILE_NAME, TILE_MASK_FILE_NAME, TRANSP_COLOR
+from src.kl_board import tiles_mask, file_digest, MASK_DIGEST_KEY
 
-from src.kl_enum import pix_list, tile_list, TILE_SIZE, TILE_FILE_NAME
 
+def check_theme() -> None:
+    '''Check that each kind of tile has its own row in the big pixmap'''
+    if sorted(tile_list.values()) != list(range(len(tile_list))):
+        raise ValueError("tile_list must number the tiles from 0 to %d" % (len(tile_list) - 1))
 
-def generate_pix(image: QImage, piece_name: str) -> None:
-    """Create an image the sub-tiles for the piece_name"""
+
+def load_tile(pname: str) -> QImage:
+    '''Load a sub-tile and check its size'''
     pix = QImage()
-    xoffset = 0
-    yoffset = tile_list[piece_name] * TILE_SIZE
-    for p in pix_list:
-        pname = piece_name + "/" + p + ".xpm"
-        if not pix.load(pname):
-            raise ValueError("Unable to load " + pname)
+    if not pix.load(pname):
+        raise ValueError("Unable to load " + pname)
+    if pix.width() != TILE_SIZE or pix.height() != TILE_SIZE:
+        raise ValueError(
+            "%s is %dx%d, tiles must be %dx%d" % (pname, pix.width(), pix.height(), TILE_SIZE, TILE_SIZE)
+        )
+    return pix
 
-        for i in range(TILE_SIZE):
-            for j in range(TILE_SIZE):
-                image.setPixel(xoffset + i, yoffset + j, pix.pixel(i, j))
 
-        xoffset = xoffset + TILE_SIZE
+def generate_pix(painter: QPainter, piece_name: str) -> None:
+    """Copy the sub-tiles for the piece_name on the image of painter"""
+    yoffset = tile_list[piece_name] * TILE_SIZE
+    for i, p in enumerate(pix_list):
+        painter.drawImage(i * TILE_SIZE, yoffset, load_tile(piece_name + "/" + p + ".xpm"))
 
 
 def main() -> None:
+    check_theme()
     result = QImage(TILE_SIZE * len(pix_list), TILE_SIZE * len(tile_list), QImage.Format_ARGB32)
+    result.fill(TRANSP_COLOR)
+
+    painter = QPainter(result)
+    # copy the pixels as they are, without blending
+    painter.setCompositionMode(QPainter.CompositionMode_Source)
     for t in tile_list.keys():
         print("Generating pixmap for ", t)
-    generate_pix(result, t)
+        generate_pix(painter, t)
+    painter.end()
+
+    fname = "../src/" + TILE_FILE_NAME
+    if not result.save(fname, "PNG"):
+        raise ValueError("Unable to save " + fname)
+    print(fname + " generated!")
 
-    print("../src/" + TILE_FILE_NAME + " generated!")
-    result.save("../src/" + TILE_FILE_NAME, "PNG")
+    mask = tiles_mask(result)
+    # the mask is used only with the tiles it was generated from
+    mask.setText(MASK_DIGEST_KEY, file_digest(fname))
+    fname = "../src/" + TILE_MASK_FILE_NAME
+    if not mask.save(fname, "PNG"):
+        raise ValueError("Unable to save " + fname)
+    print(fname + " generated!")
 
 
 if __name__ == '__main__':
@@ -6,7 +6,7 @@ block_cipher = None
 
 a = Analysis(['run_klotski.py'],
              pathex=[],
-             binaries=[('src\\klotski-icon.png', '.'), ('src\\klotski-tiles.png', '.')],
+             binaries=[('src\\klotski-icon.png', '.'), ('src\\klotski-tiles.png', '.'), ('src\\klotski-tiles-mask.png', '.')],
              datas=[('src\\boards.kts', '.')],
              hiddenimports=[],
              hookspath=[],
@@ -3,5 +3,6 @@ pyinstaller run_klotski.py ^
 	--add-data src\boards.kts;. ^
 	--add-binary src\klotski-icon.png;. ^
 	--add-binary src\klotski-tiles.png;. ^
+	--add-binary src\klotski-tiles-mask.png;. ^
 	--onefile --windowed --icon src\klotski-icon.ico
 	
\ No newline at end of file
@@ -32,12 +32,22 @@ setup(
     packages=['klotski'],
     package_dir={'klotski': 'src'},
     package_data={
-        'klotski': ['boards.kts', 'klotski-icon.png', 'klotski-tiles.png', 'README.md'],
+        'klotski': [
+            'boards.kts',
+            'distances/*.kld',
+            'klotski-icon.png',
+            'klotski-tiles.png',
+            'klotski-tiles-mask.png',
+            'README.md',
+        ],
     },
     entry_points={
         'gui_scripts': [
             'klotski=klotski.klotski:main',
         ],
+        'console_scripts': [
+            'klotski-analyze=klotski.kl_analyze:main',
+        ],
     },
     keywords='game',
     classifiers=[
@@ -0,0 +1,89 @@
+'''
+Statistics on the graph of the positions of levels, to grade and sort them.
+
+For each level, all the positions reachable from the start are enumerated
+as packed states, then the distance to a win of each of them is computed
+(see kl_distance.retrograde_analysis()). One JSON object per level is
+written on a line of the output as soon as the level is done:
+
+- name, digest: the level
+- positions: number of positions reachable from the start
+- winning: number of these positions where the game is won
+- dead_ends: number of positions from which the game can not be won
+- depth: distance from the start to the farthest position
+- hardest: largest distance to a win among the positions which are not dead ends
+- min_steps: length of the shortest solution in moves of one cell, null if there is none
+- min_moves: length of the shortest solution in moves of a piece, null if there is none
+- elapsed: analysis time in seconds
+
+Positions which differ only by swapping pieces of the same shape, or by a
+reflection of the board, are counted once (see KLLayout.key()). The step
+metric is used for depth and hardest.
+
+Run "klotski-analyze --help", or "python -m klotski.kl_analyze --help" .
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Dict, List, Optional, Any, TextIO
+import sys, json, time, pathlib, argparse
+
+from .kl_model import KLModel, load_maps, start_position
+from .kl_state import KLLayout
+from .kl_solver import Metric, Algorithm, solve_layout
+from .kl_distance import retrograde_analysis, NO_WIN
+
+
+def analyze(m: KLModel, max_states: Optional[int] = None) -> Dict[str, Any]:
+    '''Return the statistics of the level of m, or a dict with "skipped" set to true
+    when the level has more than max_states positions'''
+    t0 = time.perf_counter()
+    layout = KLLayout(start_position(m))
+    stats = {'name': m.name, 'digest': m.digest}  # type: Dict[str, Any]
+
+    layers = []  # type: List[int]
+    result = retrograde_analysis(layout, Metric.steps, max_states, layers)
+    if result is None:
+        stats['skipped'] = True
+        return stats
+    keys, distances = result
+
+    dead_ends = distances.count(NO_WIN)
+    stats['positions'] = len(keys)
+    stats['winning'] = distances.count(0)
+    stats['dead_ends'] = dead_ends
+    stats['depth'] = len(layers) - 1
+    stats['hardest'] = max((d for d in distances if d != NO_WIN), default=None)
+    stats['min_steps'] = None if distances[0] == NO_WIN else distances[0]
+    stats['min_moves'] = None
+    if distances[0] != NO_WIN:
+        sol = solve_layout(layout, Metric.moves, Algorithm.bfs)
+        stats['min_moves'] = sol.moves
+    stats['elapsed'] = round(time.perf_counter() - t0, 3)
+    return stats
+
+
+def analyze_file(fname: str, names: List[str], out: TextIO, max_states: Optional[int] = None) -> None:
+    '''Write the statistics of the levels of a board file to out, all of them if names is empty'''
+    maps = load_maps(fname)
+    for level_id in sorted(maps):
+        m = maps[level_id]
+        if names and m.name not in names:
+            continue
+        out.write(json.dumps(analyze(m, max_states)) + '\n')
+        out.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Statistics on the positions of the levels of a board file, '
+                                                 'as JSON lines')
+    parser.add_argument('names', nargs='*', help='names of the levels, all of them by default')
+    parser.add_argument('--boards', default=str(pathlib.Path(__file__).parent / "boards.kts"),
+                        help='board file, boards.kts by default')
+    parser.add_argument('--max-states', type=int, default=None, help='skip the levels with more positions')
+    args = parser.parse_args()
+    analyze_file(args.boards, args.names, sys.stdout, args.max_states)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Automatic save of the game after every move, to resume it on the next launch.
+
+The snapshot of the game (see kl_snapshot.py) is written on a thread of the
+Qt thread pool, so that a move never waits for the disk. When the player
+moves faster than the snapshots are written, the waiting snapshots are
+replaced by the last one: only the last position matters.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Optional
+import os, struct, threading
+
+from PyQt5.QtCore import QRunnable, QThreadPool, QStandardPaths
+
+from .kl_snapshot import KLSnapshot, SNAPSHOT_SUFFIX, write_snapshot
+
+
+def autosave_fname() -> str:
+    '''Return the name of the file of the automatic save'''
+    path = QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation)
+    return os.path.join(path, 'klotski', 'autosave' + SNAPSHOT_SUFFIX)
+
+
+class KLAutosaveTask(QRunnable):
+    '''Writes the snapshots of a KLAutosave until none is waiting, on a thread of the pool'''
+
+    def __init__(self, autosave: 'KLAutosave') -> None:
+        QRunnable.__init__(self)
+        self.autosave = autosave
+
+    def run(self) -> None:
+        self.autosave.write_pending()
+
+
+class KLAutosave:
+    '''Writes the snapshots of the game to the file fname, in the background'''
+
+    def __init__(self, fname: str) -> None:
+        self.fname = fname
+        self.cond = threading.Condition()
+        # snapshot waiting to be written, None to remove the file
+        self.pending = None  # type: Optional[KLSnapshot]
+        self.dirty = False
+        self.task = None  # type: Optional[KLAutosaveTask]
+
+    def save(self, snapshot: Optional[KLSnapshot]) -> None:
+        '''Write snapshot to the file, or remove the file when snapshot is None.
+        The snapshot must not be modified afterwards.'''
+        with self.cond:
+            self.pending = snapshot
+            self.dirty = True
+            if self.task is not None:
+                # the running task writes it when done with the previous one
+                return
+            self.task = KLAutosaveTask(self)
+        QThreadPool.globalInstance().start(self.task)
+
+    def write_pending(self) -> None:
+        while True:
+            with self.cond:
+                if not self.dirty:
+                    self.task = None
+                    self.cond.notify_all()
+                    return
+                snapshot = self.pending
+                self.dirty = False
+            try:
+                if snapshot is None:
+                    if os.path.exists(self.fname):
+                        os.remove(self.fname)
+                else:
+                    os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+                    write_snapshot(self.fname, snapshot)
+            except (OSError, ValueError, OverflowError, struct.error):
+                # the automatic save is only a convenience
+                pass
+
+    def wait(self) -> None:
+        '''Wait until the last snapshot is written'''
+        with self.cond:
+            while self.task is not None:
+                self.cond.wait()
@@ -0,0 +1,206 @@
+'''
+KLBitMap is an alternative implementation of KLModel, where the board is stored
+as integer bit masks instead of a grid of strings.
+
+The board is padded with one column on the right and one row above and below,
+so that shifting a mask never wraps from one row to the next without hitting
+the padding. Each cell x, y of the board is the bit (y + 1) * stride + x .
+
+Checking a move is then a shift and an AND against the occupancy mask. The
+string grid (xymap) and pid() are still available, computed from the masks
+when needed.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Tuple, Dict, List, Iterator
+
+from .kl_enum import Piece
+from .kl_model import KLModel, KLMove
+
+
+def shift_mask(mask: int, shift: int) -> int:
+    '''Shift a mask by shift bits, towards the higher bits if shift is positive'''
+    if shift >= 0:
+        return mask << shift
+    return mask >> -shift
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    '''Iterate over the index of the bits set in mask, lowest first'''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class KLBitMap(KLModel):
+    def __init__(self) -> None:
+        self._grid = []  # type: List[ List[str] ]
+        # True when the masks have changed since _grid was last computed
+        self._grid_dirty = False
+        self.stride = 0
+        self.wall_mask = 0  # walls and padding
+        self.s_wall_mask = 0
+        self.goal_mask = 0
+        self.piece_mask = {}  # type: Dict[str, int]
+        self.occupancy = 0  # everything which blocks a moving piece
+        super().__init__()
+
+    @property
+    def xymap(self) -> List[List[str]]:
+        '''The board as a grid of piece ids, computed from the masks'''
+        if self._grid_dirty:
+            self._grid = self.masks_to_grid()
+            self._grid_dirty = False
+        return self._grid
+
+    @xymap.setter
+    def xymap(self, grid: List[List[str]]) -> None:
+        self._grid = grid
+        self._grid_dirty = False
+
+    def bit(self, x: int, y: int) -> int:
+        '''Return the mask of the cell x,y'''
+        return 1 << ((y + 1) * self.stride + x)
+
+    def cells_mask(self, cells: Tuple[Tuple[int, int], ...]) -> int:
+        '''Return the mask of a list of cells'''
+        m = 0
+        for x, y in cells:
+            m |= self.bit(x, y)
+        return m
+
+    def mask_cells(self, mask: int) -> List[Tuple[int, int]]:
+        '''Return the list of cells of a mask, the padding is ignored'''
+        cells = []
+        for idx in iter_bits(mask):
+            y, x = divmod(idx, self.stride)
+            if x < self.w and 0 < y <= self.h:
+                cells.append((x, y - 1))
+        return cells
+
+    def build_masks(self) -> None:
+        '''Compute all the masks from the xymap'''
+        self.stride = self.w + 1
+        all_cells = (1 << ((self.h + 2) * self.stride)) - 1
+        board = 0
+        self.wall_mask = 0
+        self.goal_mask = self.cells_mask(tuple(self.goal))
+        self.s_wall_mask = self.cells_mask(tuple(self.s_wall))
+        self.piece_mask = {}
+        for y in range(self.h):
+            for x in range(self.w):
+                board |= self.bit(x, y)
+                pid = self._grid[y][x]
+                if pid == Piece.wall:
+                    self.wall_mask |= self.bit(x, y)
+                elif self.isPidMoveable(pid):
+                    self.piece_mask[pid] = self.piece_mask.get(pid, 0) | self.bit(x, y)
+        self.wall_mask |= all_cells & ~board
+
+        self.occupancy = self.wall_mask | self.s_wall_mask
+        for m in self.piece_mask.values():
+            self.occupancy |= m
+
+    def masks_to_grid(self) -> List[List[str]]:
+        '''Compute the xymap from the masks'''
+        grid = []
+        for y in range(self.h):
+            row = []
+            for x in range(self.w):
+                b = self.bit(x, y)
+                if self.wall_mask & b:
+                    row.append(Piece.wall)
+                elif self.s_wall_mask & b:
+                    row.append(Piece.s_wall)
+                elif self.goal_mask & b:
+                    row.append(Piece.goal)
+                else:
+                    row.append(Piece.space)
+            grid.append(row)
+
+        for pid, m in self.piece_mask.items():
+            for x, y in self.mask_cells(m):
+                grid[y][x] = pid
+        return grid
+
+    def init_level(self) -> None:
+        super().init_level()
+        self.build_masks()
+
+    def reset(self) -> None:
+        super().reset()
+        self.build_masks()
+
+    def pid(self, x: int, y: int) -> str:
+        '''Return the piece id located at x,y'''
+        if x < 0 or y < 0:
+            return Piece.none
+        if x >= self.w or y >= self.h:
+            return Piece.none
+        if not self._grid_dirty:
+            return self._grid[y][x]
+
+        b = self.bit(x, y)
+        if self.occupancy & b:
+            if self.wall_mask & b:
+                return Piece.wall
+            if self.s_wall_mask & b:
+                return Piece.s_wall
+            for pid, m in self.piece_mask.items():
+                if m & b:
+                    return pid
+        if self.goal_mask & b:
+            return Piece.goal
+        return Piece.space
+
+    def canMove(self, pid: str, dx: int, dy: int) -> bool:
+        if abs(dx) + abs(dy) != 1:
+            raise ValueError("test of illegal move")
+
+        if not self.isPidMoveable(pid):
+            return False
+
+        if pid not in self.piece_mask:
+            return True
+
+        m = self.piece_mask[pid]
+        blocking = self.occupancy & ~m
+        # moving through the door is ok for the heart piece
+        if pid == Piece.heart:
+            blocking &= ~self.s_wall_mask
+        return shift_mask(m, dy * self.stride + dx) & blocking == 0
+
+    def is_game_won(self) -> bool:
+        '''Return True if the game is won'''
+        return self.goal_mask & ~self.piece_mask.get(Piece.heart, 0) == 0
+
+    def apply_move(self, move: KLMove) -> None:
+        old = self.piece_mask[move.pid]
+        new = shift_mask(old, move.dy * self.stride + move.dx)
+        self.piece_mask[move.pid] = new
+        self.occupancy = (self.occupancy & ~old) | new
+
+        for p in move.s_walls_removed:
+            # no longer a s_wall
+            self.s_wall_removed(*p)
+            self.s_wall.remove(p)
+            self.s_wall_mask &= ~self.bit(*p)
+
+        self.shift_piece_index(move.pid, move.dx, move.dy)
+        self._grid_dirty = True
+
+    def revert_move(self, move: KLMove) -> None:
+        for p in move.s_walls_removed:
+            self.s_wall.append(p)
+            self.s_wall_mask |= self.bit(*p)
+            self.s_wall_restored(*p)
+
+        new = self.piece_mask[move.pid]
+        old = shift_mask(new, -(move.dy * self.stride + move.dx))
+        self.piece_mask[move.pid] = old
+        self.occupancy = (self.occupancy & ~new) | old | self.s_wall_mask
+
+        self.shift_piece_index(move.pid, -move.dx, -move.dy)
+        self._grid_dirty = True
@@ -6,8 +6,8 @@ moves, ...
 Author: Philippe Fremy
 License: Gnu GPL (see fname LICENSE)
 '''
-from typing import Optional, Tuple, List, Dict
-import math, pathlib
+from typing import Optional, Tuple, List, Dict, Callable
+import os, math, hashlib, pathlib, functools
 
 import sys
 if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
@@ -17,10 +17,11 @@ else:
 
 from PyQt5.QtWidgets import QSizePolicy, QFrame, QGraphicsScene, QGraphicsView, QWidget, QGraphicsPixmapItem
 from PyQt5.QtGui import QImage, QBitmap, QPixmap, QPainter, QBrush, QColor, QMouseEvent
-from PyQt5.QtCore import QTimer, pyqtSignal, QSize, Qt
+from PyQt5.QtCore import QTimer, QStandardPaths, QVariantAnimation, QPointF, pyqtSignal, QSize, Qt
 
-from .kl_enum import (TILE_FILE_NAME, TRANSP_COLOR, MINI_TILE_SIZE, Piece,
+from .kl_enum import (TILE_FILE_NAME, TILE_MASK_FILE_NAME, TRANSP_COLOR, MINI_TILE_SIZE, Piece, tile_list,
                       Tile, TILE_SIZE, PIX_SIZE, piece_tile, is_piece, mini_tile_colors)
+from .kl_model import KLModel, start_position
 from .kl_map import KLMap
 
 
@@ -32,6 +33,106 @@ def cos(a: Tuple[int, int], b: Tuple[int, int]) -> float:
     return float(scal) / (na * nb)
 
 
+# text of the mask file holding the digest of the tiles file it was generated from
+MASK_DIGEST_KEY = 'tiles-sha1'
+
+
+def file_digest(fname: str) -> str:
+    '''Return the sha1 of the content of a file'''
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def tiles_mask(img_tile: QImage) -> QImage:
+    '''Return the mask of the tiles image, where the pixels of TRANSP_COLOR are 0 and the others 1'''
+    return img_tile.createMaskFromColor(TRANSP_COLOR, Qt.MaskOutColor)
+
+
+# duration of the slide of a piece by a move, in milliseconds
+MOVE_DURATION = 100
+
+# position of the four quarters of a tile
+offset_list = [(0, 0), (PIX_SIZE, 0), (PIX_SIZE, PIX_SIZE), (0, PIX_SIZE)]
+
+# Value assiociated with each neighbour
+#
+#   2 | 1  1 | 2
+#   -----  -----
+#   4 | XXXX | 4
+#       XXXX
+#   4 | XXXX | 4
+#   -----  -----
+#   2 | 1  1 | 2
+#
+# (dx, dy, val)
+neighbour_val_list = [
+    [(0, -1, 1), (-1, -1, 2), (-1, 0, 4)],
+    [(0, -1, 1), (1, -1, 2), (1, 0, 4)],
+    [(0, 1, 1), (1, 1, 2), (1, 0, 4)],
+    [(0, 1, 1), (-1, 1, 2), (-1, 0, 4)],
+]
+
+# which pixmap to choose according to the value of the
+#   neighbours
+which_quarter = {
+    0: Tile.corner,
+    1: Tile.ver_edge,
+    2: Tile.corner,
+    3: Tile.ver_edge,
+    4: Tile.hor_edge,
+    5: Tile.miss_corner,
+    6: Tile.hor_edge,
+    7: Tile.inner,
+}
+
+# tile type, then the sub-tile of each quarter
+TileVariant = Tuple[int, int, int, int, int]
+
+
+def quarters_variant(same: Callable[[int, int], bool]) -> Tuple[int, int, int, int]:
+    '''Return the sub-tiles of the quarters of a tile, same(dx, dy) telling whether the neighbour
+    dx, dy is part of the same piece'''
+    quarters = []
+    for neighbour_val in neighbour_val_list:
+        pix_nb = 0
+        for dx, dy, val in neighbour_val:
+            if same(dx, dy):
+                pix_nb = pix_nb + val
+        quarters.append(which_quarter[pix_nb])
+    return (quarters[0], quarters[1], quarters[2], quarters[3])
+
+
+def tile_variant(m: KLModel, x: int, y: int) -> TileVariant:
+    '''Return the tile type of the cell x, y and the sub-tiles of its quarters, chosen according to
+    the neighbours of the cell which are part of the same piece'''
+    pid = m.pid(x, y)
+    piece_type = Piece.pieces[0] if is_piece(pid) else pid
+    return (piece_tile[piece_type],) + quarters_variant(lambda dx, dy: pid == m.pid(x + dx, y + dy))
+
+
+def all_tile_variants() -> List[TileVariant]:
+    '''Return all the variants tile_variant() can return'''
+    neighbours = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+    quarters = set()
+    # every combination of the neighbours being part of the piece or not
+    for same in range(1 << len(neighbours)):
+        quarters.add(quarters_variant(lambda dx, dy: bool(same & (1 << neighbours.index((dx, dy))))))
+    return [(tile,) + q for tile in sorted(tile_list.values()) for q in sorted(quarters)]
+
+
+def mini_map_cache_dir() -> str:
+    '''Return the directory of the minimaps saved by KLBoard.mini_map()'''
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), 'klotski', 'minimaps')
+
+
+def mini_map_fname(m: KLModel) -> str:
+    '''Return the file name of the minimap of the level of m. It changes with the level,
+    the size of the tiles and the colors of the minimaps, so that an outdated file is never used.'''
+    h = hashlib.sha1(m.digest.encode())
+    h.update(repr((MINI_TILE_SIZE, sorted(mini_tile_colors.items()))).encode())
+    return h.hexdigest() + '.png'
+
+
 class KLBoard(QGraphicsView):
 
     sig_move = pyqtSignal(tuple)
@@ -42,7 +143,12 @@ class KLBoard(QGraphicsView):
         self.setSizePolicy(QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding))
         self.setLineWidth(2)
         self.setFrameShape(QFrame.NoFrame)
-        self.scene_item_dict = {}  # type: Dict[str, List[QGraphicsPixmapItem]]
+        # one item for each moveable piece
+        self.piece_items = {}  # type: Dict[str, QGraphicsPixmapItem]
+        # item of the s_wall of each cell
+        self.s_wall_items = {}  # type: Dict[Tuple[int, int], QGraphicsPixmapItem]
+        # animation of each sliding piece, with the position of its item before the slide
+        self.slides = {}  # type: Dict[str, Tuple[QVariantAnimation, QPointF]]
         self.m_scene = QGraphicsScene(self)
 
         self.is_draging = False
@@ -56,27 +162,28 @@ class KLBoard(QGraphicsView):
 
     pix_tiles = None  # type: Optional[QPixmap]
     tiles_mask = None  # type: Optional[QBitmap]
+    # pixmap of each tile variant, shared by all the items of the scene
+    tile_pixmaps = {}  # type: Dict[TileVariant, QPixmap]
+    # pixmap of each piece, by the position and variant of its tiles
+    piece_pixmaps = {}  # type: Dict[Tuple[Tuple[int, int, TileVariant], ...], QPixmap]
 
     def load_tiles(self) -> None:
         """Load the tiles representation from the default filename and put the result and the bitmap mask
         in KLBoard.tiles_mask and KLBoard.pix_tiles"""
         if RUNNING_IN_PYINSTALLER:
-            img_tile = QImage(str(pathlib.Path(__file__).parent.parent / TILE_FILE_NAME))
+            theme_dir = pathlib.Path(__file__).parent.parent
         else:
-            img_tile = QImage(str(pathlib.Path(__file__).parent / TILE_FILE_NAME))
+            theme_dir = pathlib.Path(__file__).parent
+        img_tile = QImage(str(theme_dir / TILE_FILE_NAME))
 
         w = img_tile.width()
         h = img_tile.height()
         assert w != 0 and h != 0, "%s gives a null image" % TILE_FILE_NAME
 
-        # Build mask
-        img_mask = QImage(w, h, QImage.Format_Mono)
-        for x in range(w):
-            for y in range(h):
-                if img_tile.pixel(x, y) == TRANSP_COLOR:
-                    img_mask.setPixel(x, y, 0)
-                else:
-                    img_mask.setPixel(x, y, 1)
+        img_mask = QImage(str(theme_dir / TILE_MASK_FILE_NAME))
+        if img_mask.text(MASK_DIGEST_KEY) != file_digest(str(theme_dir / TILE_FILE_NAME)):
+            # no precompiled mask, or the mask of another theme
+            img_mask = tiles_mask(img_tile)
 
         KLBoard.tiles_mask = QBitmap()
         if not KLBoard.tiles_mask.convertFromImage(img_mask, Qt.MonoOnly | Qt.ThresholdDither
@@ -87,20 +194,51 @@ class KLBoard(QGraphicsView):
         if not KLBoard.pix_tiles.convertFromImage(img_tile):
             raise Exception("Could not convert to Pixmap !")
 
+        KLBoard.tile_pixmaps = {variant: self.render_tile(variant) for variant in all_tile_variants()}
+        KLBoard.piece_pixmaps = {}
+
     def del_s_wall(self, x: int, y: int) -> None:
         '''Called when a s_wall is hit by the heart piece, to hide it'''
-        for cs in self.scene_item_dict[Piece.s_wall]:
-            if cs.x() == x * TILE_SIZE and cs.y() == y * TILE_SIZE:
-                cs.setVisible(False)
+        if (x, y) in self.s_wall_items:
+            self.s_wall_items[(x, y)].setVisible(False)
+
+    def add_s_wall(self, x: int, y: int) -> None:
+        '''Called when a s_wall comes back after an undo, to show it again'''
+        if (x, y) in self.s_wall_items:
+            self.s_wall_items[(x, y)].setVisible(True)
+
+    def mini_map_size(self, m: KLModel) -> QSize:
+        '''Return the size of the QPixmap generated by generate_mini_map()'''
+        return QSize(MINI_TILE_SIZE * (m.w + 2) - 1, MINI_TILE_SIZE * (m.h + 2) - 1)
+
+    def mini_map(self, m: KLModel) -> QPixmap:
+        '''Return the minimap of the start position of the level of m, loaded from the minimap cache.
+        It is generated and saved there when it is missing.'''
+        path = os.path.join(mini_map_cache_dir(), mini_map_fname(m))
+        if os.path.exists(path):
+            pm = QPixmap(path)
+            if not pm.isNull():
+                return pm
+
+        pm = self.generate_mini_map(start_position(m))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.tmp.png'
+            if pm.save(tmp, 'PNG'):
+                os.replace(tmp, path)
+        except OSError:
+            # the cache is only an optimisation
+            pass
+        return pm
 
-    def generate_mini_map(self, m: KLMap) -> QPixmap:
+    def generate_mini_map(self, m: KLModel) -> QPixmap:
         '''Generate a QPixmap representing the map (to be used as an icon)'''
-        pm = QPixmap(MINI_TILE_SIZE * (m.w + 2) - 1, MINI_TILE_SIZE * (m.h + 2) - 1)
-        pm.fill(mini_tile_colors[Tile.space])
+        pm = QPixmap(self.mini_map_size(m))
+        pm.fill(QColor(mini_tile_colors[Tile.space]))
         p = QPainter(pm)
 
         # draw border
-        brush = QBrush(mini_tile_colors[piece_tile[Piece.wall]])
+        brush = QBrush(QColor(mini_tile_colors[piece_tile[Piece.wall]]))
         p.fillRect(0, 0, MINI_TILE_SIZE * (m.w + 2), MINI_TILE_SIZE - 1, brush)
         p.fillRect(0, 0, MINI_TILE_SIZE - 1, MINI_TILE_SIZE * (m.h + 2), brush)
         p.fillRect(0, MINI_TILE_SIZE * (m.h + 1), MINI_TILE_SIZE * (m.w + 2), MINI_TILE_SIZE - 1, brush)
@@ -145,111 +283,100 @@ class KLBoard(QGraphicsView):
         return pm
 
     def generate_scene(self, m: KLMap) -> None:
-        '''Generate a QGraphicScene object from a map and fills up the scene_item_dict'''
+        '''Generate a QGraphicScene object from a map and fills up piece_items and s_wall_items'''
+        self.stop_slides()
         new_scene = QGraphicsScene(0, 0, m.w * TILE_SIZE, m.h * TILE_SIZE)
         self.setScene(new_scene)
-        del self.scene_item_dict
         if self.m_scene:
             del self.m_scene
         self.m_scene = new_scene
-        self.scene_item_dict = {}
+        self.piece_items = {}
+        self.s_wall_items = {}
 
         #  set the background color <=> fill
         self.m_scene.setBackgroundBrush(Qt.black)
 
-        pix = QPixmap(TILE_SIZE, TILE_SIZE)
-        mask = QBitmap(TILE_SIZE, TILE_SIZE)
-
+        # walls, special walls and goals, one item per cell
         for x in range(m.w):
             for y in range(m.h):
                 pid = m.pid(x, y)
-                if pid == Piece.space:
+                if pid == Piece.space or m.isPidMoveable(pid):
                     continue
 
-                # We pass the pixmap and bitmap object to avoid recreating them
-                # on each function call
-                self.set_tile_pix(pix, mask, x, y)
-                item = QGraphicsPixmapItem(pix)
-                item.setX(x * TILE_SIZE)
-                item.setY(y * TILE_SIZE)
+                item = QGraphicsPixmapItem(KLBoard.tile_pixmaps[tile_variant(m, x, y)])
+                item.setPos(x * TILE_SIZE, y * TILE_SIZE)
+                item.setZValue(1)
                 self.m_scene.addItem(item)
-
-                # moving tiles are above walls, special walls
-                # and goals
-                if pid == Piece.goal or pid == Piece.wall or pid == Piece.s_wall:
-                    item.setZValue(1)
-                else:
-                    item.setZValue(10)
-
-                if pid not in self.scene_item_dict:
-                    self.scene_item_dict[pid] = []
-                self.scene_item_dict[pid].append(item)
-
-                item.show()
+                if pid == Piece.s_wall:
+                    self.s_wall_items[(x, y)] = item
+
+        # moving tiles are above walls, special walls
+        # and goals
+        for pid in m.piece_cells:
+            xmin, ymin, _, _ = m.piece_bbox[pid]
+            item = QGraphicsPixmapItem(self.piece_pixmap(m, pid))
+            item.setPos(xmin * TILE_SIZE, ymin * TILE_SIZE)
+            item.setZValue(10)
+            self.m_scene.addItem(item)
+            self.piece_items[pid] = item
+
+    def piece_pixmap(self, m: KLModel, pid: str) -> QPixmap:
+        '''Return the pixmap of the piece pid, composed of the pixmaps of its tiles'''
+        xmin, ymin, xmax, ymax = m.piece_bbox[pid]
+        tiles = tuple(sorted((x - xmin, y - ymin, tile_variant(m, x, y)) for (x, y) in m.piece_cells[pid]))
+        if tiles not in KLBoard.piece_pixmaps:
+            pix = QPixmap((xmax - xmin + 1) * TILE_SIZE, (ymax - ymin + 1) * TILE_SIZE)
+            pix.fill(Qt.transparent)
+            p = QPainter(pix)
+            for x, y, variant in tiles:
+                p.drawPixmap(x * TILE_SIZE, y * TILE_SIZE, KLBoard.tile_pixmaps[variant])
+            p.end()
+            KLBoard.piece_pixmaps[tiles] = pix
+        return KLBoard.piece_pixmaps[tiles]
 
     def set_map(self, m: KLMap) -> None:
+        '''Display the map m. The scene is generated again only for another map than the current one,
+        else its items are moved to the current position of m.'''
+        if m is self.klmap:
+            self.update_scene()
+            return
+
+        try:
+            self.klmap.sig_del_s_wall.disconnect(self.del_s_wall)
+            self.klmap.sig_add_s_wall.disconnect(self.add_s_wall)
+        except TypeError:
+            # the empty map created with the board is not connected
+            pass
         m.sig_del_s_wall.connect(self.del_s_wall)
+        m.sig_add_s_wall.connect(self.add_s_wall)
         self.klmap = m
         # note: the size of the new map is picked up by the sizeHint()
         self.generate_scene(m)
         self.update()
 
+    def update_scene(self) -> None:
+        '''Put the pieces and s_walls of the scene at the current position of the map, at once'''
+        self.stop_slides()
+        for pid, item in self.piece_items.items():
+            xmin, ymin, _, _ = self.klmap.piece_bbox[pid]
+            item.setPos(xmin * TILE_SIZE, ymin * TILE_SIZE)
+        s_walls = set(self.klmap.s_wall)
+        for cell, item in self.s_wall_items.items():
+            item.setVisible(cell in s_walls)
+
     def sizeHint(self) -> QSize:
         return QSize(self.klmap.w * TILE_SIZE, self.klmap.h * TILE_SIZE)
 
-    def set_tile_pix(self, pix: QPixmap, mask: QBitmap, x: int, y: int) -> None:
-        """Create the pixmap for the part of the piece located at x,y .
-        The pixmap is created inside the pix argument"""
-        pid = self.klmap.pid(x, y)
-        piece_type = pid
-        if is_piece(piece_type):
-            piece_type = Piece.pieces[0]
-
-        offset_list = [(0, 0), (PIX_SIZE, 0), (PIX_SIZE, PIX_SIZE), (0, PIX_SIZE)]
-
-        # Value assiociated with each neighbour
-        #
-        #   2 | 1  1 | 2
-        #   -----  -----
-        #   4 | XXXX | 4
-        #       XXXX
-        #   4 | XXXX | 4
-        #   -----  -----
-        #   2 | 1  1 | 2
-        #
-        # (dx, dy, val)
-        neighbour_val_list = [
-            [(0, -1, 1), (-1, -1, 2), (-1, 0, 4)],
-            [(0, -1, 1), (1, -1, 2), (1, 0, 4)],
-            [(0, 1, 1), (1, 1, 2), (1, 0, 4)],
-            [(0, 1, 1), (-1, 1, 2), (-1, 0, 4)],
-        ]
-
-        # which pixmap to choose according to the value of the
-        #   neighbours
-        which_quarter = {
-            0: Tile.corner,
-            1: Tile.ver_edge,
-            2: Tile.corner,
-            3: Tile.ver_edge,
-            4: Tile.hor_edge,
-            5: Tile.miss_corner,
-            6: Tile.hor_edge,
-            7: Tile.inner,
-        }
-
+    def render_tile(self, variant: TileVariant) -> QPixmap:
+        """Create the pixmap of a tile variant, from the quarters of the sub-tiles of the theme"""
+        tile = variant[0]
+        pix = QPixmap(TILE_SIZE, TILE_SIZE)
+        mask = QBitmap(TILE_SIZE, TILE_SIZE)
         p = QPainter(pix)
         pm = QPainter(mask)
         for i in range(4):
             offset = offset_list[i]
-            neighbour_val = neighbour_val_list[i]
-
-            pix_nb = 0
-            for neigh in neighbour_val:
-                if pid == self.klmap.pid(x + neigh[0], y + neigh[1]):
-                    pix_nb = pix_nb + neigh[2]
-
-            quarter_nb = which_quarter[pix_nb]
+            quarter_nb = variant[i + 1]
 
             assert KLBoard.pix_tiles  # to help mypy making sure that tiles_mask is not None
             p.drawPixmap(
@@ -257,7 +384,7 @@ class KLBoard(QGraphicsView):
                 offset[1],
                 KLBoard.pix_tiles,
                 quarter_nb * TILE_SIZE + offset[0],
-                piece_tile[piece_type] * TILE_SIZE + offset[1],
+                tile * TILE_SIZE + offset[1],
                 PIX_SIZE,
                 PIX_SIZE,
             )
@@ -268,7 +395,7 @@ class KLBoard(QGraphicsView):
                 offset[1],
                 KLBoard.tiles_mask,
                 quarter_nb * TILE_SIZE + offset[0],
-                piece_tile[piece_type] * TILE_SIZE + offset[1],
+                tile * TILE_SIZE + offset[1],
                 PIX_SIZE,
                 PIX_SIZE,
             )
@@ -276,34 +403,43 @@ class KLBoard(QGraphicsView):
         p.end()
         pm.end()
         pix.setMask(mask)
+        return pix
 
     def move_piece(self, pid: str, delta: Tuple[int, int]) -> None:
+        '''Slide the piece pid by delta cells. The slide is animated by the event loop, so this returns
+        at once. Moving a piece which is still sliding extends its slide to the new destination.'''
         dx, dy = delta
-        sz = len(self.scene_item_dict[pid])
-
-        # For big tiles, we need to move big step by big step to keep smooth
-        # display. For small tiles, we can move pixel by pixel.
-        if sz < 3:
-            incr = 1
-        elif sz < 8:
-            incr = 2
-        elif sz < 16:
-            incr = 4
-        elif sz < 32:
-            incr = 8
+        if pid in self.slides:
+            anim, _ = self.slides[pid]
+            anim.stop()
+            end = anim.endValue() + QPointF(dx * TILE_SIZE, dy * TILE_SIZE)
+            anim.setStartValue(anim.currentValue())
         else:
-            incr = 16
-
-        for _ in range(TILE_SIZE // incr):
-            for cs in self.scene_item_dict[pid]:
-                cs.moveBy(float(dx * incr), float(dy * incr))
-            self.m_scene.update()
-
-        incr = TILE_SIZE % incr
-        if incr:
-            for cs in self.scene_item_dict[pid]:
-                cs.moveBy(float(dx * incr), float(dy * incr))
-            self.m_scene.update()
+            anim = QVariantAnimation(self)
+            anim.setDuration(MOVE_DURATION)
+            anim.valueChanged.connect(functools.partial(self.slide_step, pid))
+            anim.finished.connect(functools.partial(self.slide_done, pid))
+            self.slides[pid] = (anim, self.piece_items[pid].pos())
+            end = QPointF(dx * TILE_SIZE, dy * TILE_SIZE)
+            anim.setStartValue(QPointF(0, 0))
+        anim.setEndValue(end)
+        anim.start()
+
+    def slide_step(self, pid: str, offset: QPointF) -> None:
+        '''Place the item of the sliding piece pid at offset from its position before the slide'''
+        if pid in self.slides:
+            self.piece_items[pid].setPos(self.slides[pid][1] + offset)
+
+    def slide_done(self, pid: str) -> None:
+        anim, _ = self.slides.pop(pid)
+        anim.deleteLater()
+
+    def stop_slides(self) -> None:
+        '''Stop all the slides, leaving the pieces where they are'''
+        for anim, _ in self.slides.values():
+            anim.stop()
+            anim.deleteLater()
+        self.slides.clear()
 
     def mousePressEvent(self, e: QMouseEvent) -> None:
         p = self.mapToScene(e.x(), e.y())
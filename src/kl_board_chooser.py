@@ -2,24 +2,49 @@
 Author: Philippe Fremy
 License: Gnu GPL (see file LICENSE)
 '''
-from typing import Union, Dict
+from typing import Union, Dict, Tuple, Deque, Mapping
+import collections
 
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QListView, QWidget
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import QAbstractListModel, QModelIndex, QVariant, Qt
+from PyQt5.QtGui import QPixmap, QColor
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QVariant, QTimer, Qt
 
 from .kl_enum import *
 from .kl_map import KLMap
+from .kl_board import KLBoard
+
+# number of minimaps kept in memory
+MINI_MAP_CACHE_SIZE = 256
 
 
 class KlMinimapProvider(QAbstractListModel):
-    def __init__(self, level_dict: Dict[int, KLMap], mini_maps_dict: Dict[int, QPixmap]) -> None:
+    '''Names and minimaps of the levels for the board chooser.
+
+    The view asks for the minimap of every level to lay them out: it gets a placeholder of the right
+    size, and the minimap is rendered later, when the event loop is idle. The levels asked for last,
+    the visible ones, are rendered first, then the ones not asked for yet, while there is room in the
+    cache. Beyond MINI_MAP_CACHE_SIZE, the least recently used minimaps are dropped.'''
+
+    def __init__(self, level_dict: Mapping[int, KLMap], board: KLBoard) -> None:
         super().__init__()
-        assert len(mini_maps_dict) > 0, "minimap board dict is empty!"
         assert len(level_dict) > 0, "level dict is empty!"
 
         self.level_dict = level_dict
-        self.mini_maps_dict = mini_maps_dict
+        self.board = board
+        # minimaps by level id, the least recently used first
+        self.mini_maps = collections.OrderedDict()  # type: collections.OrderedDict[int, QPixmap]
+        # placeholders by size
+        self.placeholders = {}  # type: Dict[Tuple[int, int], QPixmap]
+        # levels whose minimap was asked for before being rendered, the last one first. Only half of the
+        # cache, so that rendering them does not drop the visible minimaps.
+        self.pending = collections.deque(maxlen=MINI_MAP_CACHE_SIZE // 2)  # type: Deque[int]
+        # next level to render when none is pending
+        self.next_level = 1
+
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setInterval(0)
+        self.idle_timer.timeout.connect(self.render_next)
+        self.idle_timer.start()
 
     def rowCount(self, parentIdx: QModelIndex) -> int:  # type: ignore # mypy does not understand the Qt overload of that one
         # -1 because we don't want to display splash screen as a board
@@ -34,10 +59,54 @@ class KlMinimapProvider(QAbstractListModel):
             return self.level_dict[row + 1].name
 
         if role == Qt.DecorationRole:
-            return self.mini_maps_dict[row + 1]
+            return self.mini_map(row + 1)
 
         return QVariant()
 
+    def mini_map(self, level_id: int) -> QPixmap:
+        '''Return the minimap of a level, or its placeholder if it is not rendered yet'''
+        if level_id in self.mini_maps:
+            self.mini_maps.move_to_end(level_id)
+            return self.mini_maps[level_id]
+
+        if level_id in self.pending:
+            self.pending.remove(level_id)
+        self.pending.appendleft(level_id)
+        self.idle_timer.start()
+
+        size = self.board.mini_map_size(self.level_dict[level_id])
+        key = (size.width(), size.height())
+        if key not in self.placeholders:
+            pm = QPixmap(size)
+            pm.fill(QColor(mini_tile_colors[Tile.space]))
+            self.placeholders[key] = pm
+        return self.placeholders[key]
+
+    def render(self, level_id: int) -> None:
+        '''Load or render the minimap of a level, and tell the view'''
+        self.mini_maps[level_id] = self.board.mini_map(self.level_dict[level_id])
+        if len(self.mini_maps) > MINI_MAP_CACHE_SIZE:
+            self.mini_maps.popitem(last=False)
+        index = self.index(level_id - 1)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def render_next(self) -> None:
+        '''Render one minimap, called by the idle timer'''
+        while self.pending:
+            level_id = self.pending.popleft()
+            if level_id not in self.mini_maps:
+                self.render(level_id)
+                return
+
+        while self.next_level < len(self.level_dict) and len(self.mini_maps) < MINI_MAP_CACHE_SIZE:
+            level_id = self.next_level
+            self.next_level += 1
+            if level_id not in self.mini_maps:
+                self.render(level_id)
+                return
+
+        self.idle_timer.stop()
+
 
 class KLBoardChooser(QDialog):
     def __init__(self, minimapProvider: KlMinimapProvider, parent: QWidget) -> None:
@@ -0,0 +1,145 @@
+'''
+Binary cache of the levels of a board file, to avoid parsing and checking
+the file again on every launch.
+
+The cache of a board file is stored next to it, with the CACHE_SUFFIX
+extension. It holds the hash of the content of the board file it was built
+from: a cache whose hash or version does not match is ignored, and built
+again by load_maps().
+
+Format, all integers little endian:
+- header: magic, CACHE_VERSION (H), sha1 of the board file (20 bytes), number of levels (I)
+- for each level:
+    - name: length (H) then utf-8 bytes
+    - width (H), height (H), pid_size (B)
+    - table of the pids of the level: number of pids (B), then each one: length (B) then utf-8 bytes
+    - grid: width * height bytes, the index in the table of the pid of each cell, row by row
+    - reflections of the level (see KLModel.mirrors): number of reflections (B), then one byte each
+    - digest of the level (see KLModel.digest): 40 ascii bytes
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import List, Tuple, Optional, Dict
+import os, struct
+
+# change it when the format of the cache or the parsing of the board files changes
+CACHE_VERSION = 1
+CACHE_MAGIC = b'KLCC'
+CACHE_SUFFIX = '.cache'
+
+_HEADER = struct.Struct('<4sH20sI')
+_LEVEL = struct.Struct('<HHB')
+
+# name, pid_size, grid, reflections and digest of a level
+CachedLevel = Tuple[str, int, List[List[str]], List[int], str]
+
+
+def pack_grid(grid: List[List[str]]) -> bytes:
+    '''Return the table of the pids of grid followed by the index in the table of the pid of each cell'''
+    index = {}  # type: Dict[str, int]
+    for row in grid:
+        for pid in row:
+            index.setdefault(pid, len(index))
+    chunks = [bytes([len(index)])]
+    for pid in index:
+        encoded = pid.encode()
+        chunks.append(bytes([len(encoded)]) + encoded)
+    for row in grid:
+        chunks.append(bytes(index[pid] for pid in row))
+    return b''.join(chunks)
+
+
+def unpack_grid(data: bytes, offset: int, w: int, h: int) -> Tuple[List[List[str]], int]:
+    '''Return the grid of w x h cells packed by pack_grid() at offset in data, and the offset after it'''
+    pids = []
+    nb_pids = data[offset]
+    offset += 1
+    for _ in range(nb_pids):
+        size = data[offset]
+        pids.append(data[offset + 1 : offset + 1 + size].decode())
+        offset += 1 + size
+
+    grid = []
+    for _ in range(h):
+        grid.append([pids[i] for i in data[offset : offset + w]])
+        offset += w
+    if offset > len(data):
+        raise IndexError("truncated grid")
+    return grid, offset
+
+
+def pack_level(level: CachedLevel) -> bytes:
+    '''Return the bytes of a level in a cache file'''
+    name, pid_size, grid, mirrors, level_digest = level
+    encoded = name.encode()
+    h = len(grid)
+    w = len(grid[0]) if h else 0
+    return b''.join(
+        [
+            len(encoded).to_bytes(2, 'little') + encoded,
+            _LEVEL.pack(w, h, pid_size),
+            pack_grid(grid),
+            bytes([len(mirrors)] + mirrors),
+            level_digest.encode('ascii'),
+        ]
+    )
+
+
+def unpack_level(data: bytes, offset: int) -> Tuple[CachedLevel, int]:
+    '''Return the level packed by pack_level() at offset in data, and the offset after it'''
+    size = int.from_bytes(data[offset : offset + 2], 'little')
+    name = data[offset + 2 : offset + 2 + size].decode()
+    offset += 2 + size
+    w, h, pid_size = _LEVEL.unpack_from(data, offset)
+    offset += _LEVEL.size
+    grid, offset = unpack_grid(data, offset, w, h)
+
+    nb_mirrors = data[offset]
+    mirrors = list(data[offset + 1 : offset + 1 + nb_mirrors])
+    offset += 1 + nb_mirrors
+    level_digest = data[offset : offset + 40].decode('ascii')
+    offset += 40
+    return (name, pid_size, grid, mirrors, level_digest), offset
+
+
+def read_cache(fname: str, digest: bytes) -> Optional[List[CachedLevel]]:
+    '''Return the levels of the cache file fname, or None if it does not exist,
+    is invalid or was built from a board file with another digest'''
+    try:
+        with open(fname, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    try:
+        magic, version, cache_digest, nb_levels = _HEADER.unpack_from(data)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or cache_digest != digest:
+            return None
+        offset = _HEADER.size
+        levels = []
+        for _ in range(nb_levels):
+            level, offset = unpack_level(data, offset)
+            levels.append(level)
+    except (struct.error, IndexError, UnicodeDecodeError):
+        return None
+    if offset != len(data):
+        return None
+    return levels
+
+
+def write_cache(fname: str, digest: bytes, levels: List[CachedLevel]) -> None:
+    '''Write the levels to the cache file fname. Nothing happens if the file can not be written,
+    the cache is only an optimisation.'''
+    try:
+        chunks = [_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, digest, len(levels))]
+        for level in levels:
+            chunks.append(pack_level(level))
+
+        tmp = fname + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(chunks))
+        os.replace(tmp, fname)
+    except (OSError, ValueError, OverflowError, struct.error):
+        # a level too large for the format, or a read-only directory
+        pass
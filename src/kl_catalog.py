@@ -0,0 +1,150 @@
+'''
+KLCatalog gives access to the levels of one or several board files, by id
+or by name, parsing a level only when it is first used.
+
+The catalog only reads the index of each file: the name, offset and line
+number of every level. The index of a board file is stored next to it, with
+the INDEX_SUFFIX extension, and holds the hash of the board file it was built
+from. When it is missing or out of date, the board file is scanned for the
+level names, which is much faster than parsing the levels, and the index is
+written again.
+
+Format of an index file, all integers little endian:
+- header: magic, INDEX_VERSION (H), sha1 of the board file (20 bytes), number of levels (I)
+- for each level: offset of its name line (Q), number of its name line (I),
+  name: length (H) then utf-8 bytes
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import List, Tuple, Dict, Optional, Callable, Iterator, Mapping
+import os, re, struct, hashlib
+
+from .kl_model import KLModelT, iter_maps
+
+# change it when the format of the index changes
+INDEX_VERSION = 1
+INDEX_MAGIC = b'KLCI'
+INDEX_SUFFIX = '.index'
+
+_HEADER = struct.Struct('<4sH20sI')
+_ENTRY = struct.Struct('<QIH')
+
+# the name line of a level: <name> alone on its line
+_NAME_LINE = re.compile(rb'^[ \t\r\f\v]*<([^\n]*)>[ \t\r\f\v]*$', re.MULTILINE)
+
+# name, offset and line number of the name line of a level
+IndexEntry = Tuple[str, int, int]
+
+
+def scan_levels(data: bytes) -> List[IndexEntry]:
+    '''Return the name, offset and line number of the name line of every level of the content of a board file'''
+    entries = []
+    line_nb = 1
+    last = 0
+    for match in _NAME_LINE.finditer(data):
+        line_nb += data.count(b'\n', last, match.start())
+        last = match.start()
+        entries.append((match.group(1).decode(), match.start(), line_nb))
+    return entries
+
+
+def read_index(fname: str, digest: bytes) -> Optional[List[IndexEntry]]:
+    '''Return the entries of the index file fname, or None if it does not exist,
+    is invalid or was built from a board file with another digest'''
+    try:
+        with open(fname, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    try:
+        magic, version, index_digest, nb_levels = _HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or index_digest != digest:
+            return None
+        entries = []
+        offset = _HEADER.size
+        for _ in range(nb_levels):
+            level_offset, line_nb, size = _ENTRY.unpack_from(data, offset)
+            offset += _ENTRY.size
+            entries.append((data[offset : offset + size].decode(), level_offset, line_nb))
+            offset += size
+    except (struct.error, UnicodeDecodeError):
+        return None
+    if offset != len(data):
+        return None
+    return entries
+
+
+def write_index(fname: str, digest: bytes, entries: List[IndexEntry]) -> None:
+    '''Write the entries to the index file fname. Nothing happens if the file can not be written,
+    the index is only an optimisation.'''
+    try:
+        chunks = [_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, digest, len(entries))]
+        for name, offset, line_nb in entries:
+            encoded = name.encode()
+            chunks.append(_ENTRY.pack(offset, line_nb, len(encoded)) + encoded)
+        tmp = fname + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(chunks))
+        os.replace(tmp, fname)
+    except (OSError, struct.error):
+        pass
+
+
+def load_index(fname: str) -> List[IndexEntry]:
+    '''Return the index of the board file fname, from its index file when it is up to date'''
+    with open(fname, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).digest()
+    entries = read_index(fname + INDEX_SUFFIX, digest)
+    if entries is None:
+        entries = scan_levels(data)
+        write_index(fname + INDEX_SUFFIX, digest, entries)
+    return entries
+
+
+class KLCatalog(Mapping[int, KLModelT]):
+    '''The levels of several board files, numbered in the order of the files, then of the levels in each file.
+    A level is parsed when it is first accessed, the map object is created with factory.'''
+
+    def __init__(self, fnames: List[str], factory: Callable[[], KLModelT]) -> None:
+        self.factory = factory
+        # file name, offset of the name line, offset of the end, line number of the name line of each level
+        self.entries = []  # type: List[Tuple[str, int, int, int]]
+        self.names = []  # type: List[str]
+        # id of the first level with a given name
+        self.ids_by_name = {}  # type: Dict[str, int]
+        self.levels = {}  # type: Dict[int, KLModelT]
+
+        for fname in fnames:
+            index = load_index(fname)
+            ends = [offset for (_, offset, _) in index[1:]] + [os.path.getsize(fname)]
+            for (name, offset, line_nb), end in zip(index, ends):
+                self.ids_by_name.setdefault(name, len(self.entries))
+                self.entries.append((fname, offset, end, line_nb))
+                self.names.append(name)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self.entries)))
+
+    def __contains__(self, level_id: object) -> bool:
+        return isinstance(level_id, int) and 0 <= level_id < len(self.entries)
+
+    def __getitem__(self, level_id: int) -> KLModelT:
+        if level_id not in self.levels:
+            if level_id not in self:
+                raise KeyError(level_id)
+            fname, offset, end, line_nb = self.entries[level_id]
+            with open(fname, 'rb') as f:
+                f.seek(offset)
+                lines = f.read(end - offset).decode().splitlines()
+            self.levels[level_id] = next(iter_maps(lines, self.factory, line_nb - 1))
+        return self.levels[level_id]
+
+    def find(self, name: str) -> Optional[int]:
+        '''Return the id of the first level named name, or None if there is none'''
+        return self.ids_by_name.get(name)
@@ -0,0 +1,278 @@
+'''
+Tables of the distance to a win of every position of a level.
+
+The table of a level is built by a retrograde analysis: all the positions
+reachable from the start are enumerated with the moves between them, then
+a breadth first search going backward from the winning positions gives the
+distance to the closest win of every position. Positions from which no win
+can be reached are dead ends.
+
+Tables are built in advance, one file per level and metric, named after the
+digest of the level (see KLModel.digest), so that a modified level never
+uses the table of its previous version:
+
+    python -m klotski.kl_distance --help
+
+A table file is a header followed by an open addressing hash table, each
+slot holding the key of a position (see KLLayout.key()) and its distance.
+The file is read through mmap when a level first needs it, looking up a
+position reads one or two slots only.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import List, Dict, Tuple, Optional, Any
+from array import array
+import os, mmap, struct, time, pathlib, argparse
+
+from .kl_model import KLModel, load_maps, start_position
+from .kl_state import KLLayout, key_hash
+from .kl_solver import Metric, expand
+
+# change it when the format of the files changes
+TABLE_VERSION = 1
+TABLE_MAGIC = b'KLDT'
+# magic, version, metric, state_bytes, number of positions, number of slots, digest of the level
+TABLE_HEADER = struct.Struct('<4sHBBQQ40s')
+
+# distance of the positions from which the game can not be won
+DEAD_END = -1
+# distance of the positions which are not in the table, not reachable from the start
+UNKNOWN = -2
+
+# distance of the dead ends returned by retrograde_analysis(), and in the slots of a table
+NO_WIN = 0xFFFE
+# values of the distance field of a slot
+_EMPTY_SLOT = 0xFFFF
+_MAX_DISTANCE = 0xFFFD
+
+DEFAULT_TABLE_DIR = str(pathlib.Path(__file__).parent / 'distances')
+
+
+def table_fname(m: KLModel, metric: int) -> str:
+    '''Return the name of the table file of the level of m'''
+    return '%s.%s.kld' % (m.digest, 'moves' if metric == Metric.moves else 'steps')
+
+
+def retrograde_analysis(
+    layout: KLLayout, metric: int, max_states: Optional[int] = None, layers: Optional[List[int]] = None
+) -> Optional[Tuple[List[int], 'array[int]']]:
+    '''Return the keys of all the positions reachable from the start of layout, with their distance
+    to a win, NO_WIN for the dead ends. Return None when there are more than max_states positions.
+
+    When layers is given, the number of positions at each distance from the start is appended to it.'''
+    # enumerate the positions, with the index of their successors, in breadth first order
+    start = layout.key(layout.start)
+    index = {start: 0}  # type: Dict[int, int]
+    keys = [start]
+    successors = array('I')
+    offsets = array('Q', [0])
+    i = 0
+    layer_end = 0
+    while i < len(keys):
+        if i == layer_end:
+            if layers is not None:
+                layers.append(len(keys) - i)
+            layer_end = len(keys)
+        for t in set(layout.key(t) for t in expand(layout, keys[i], metric)):
+            j = index.get(t)
+            if j is None:
+                if max_states is not None and len(keys) >= max_states:
+                    return None
+                j = len(keys)
+                index[t] = j
+                keys.append(t)
+            successors.append(j)
+        offsets.append(len(successors))
+        i += 1
+    del index
+
+    # reverse the moves: the predecessors of j are predecessors[pred_offsets[j]:pred_offsets[j+1]]
+    n = len(keys)
+    pred_offsets = array('Q', [0]) * (n + 1)
+    for j in successors:
+        pred_offsets[j + 1] += 1
+    for j in range(n):
+        pred_offsets[j + 1] += pred_offsets[j]
+    fill = array('Q', pred_offsets)
+    predecessors = array('I', [0]) * len(successors)
+    for i in range(n):
+        for k in range(offsets[i], offsets[i + 1]):
+            j = successors[k]
+            predecessors[fill[j]] = i
+            fill[j] += 1
+    del successors, offsets, fill
+
+    # backward breadth first search from the winning positions
+    distances = array('H', [NO_WIN]) * n
+    todo = [i for i, k in enumerate(keys) if layout.is_won(k)]
+    for i in todo:
+        distances[i] = 0
+    for i in todo:
+        d = distances[i] + 1
+        if d > _MAX_DISTANCE:
+            raise ValueError("Distance too large for the table of %s" % layout.name)
+        for k in range(pred_offsets[i], pred_offsets[i + 1]):
+            p = predecessors[k]
+            if distances[p] == NO_WIN:
+                distances[p] = d
+                todo.append(p)
+    return keys, distances
+
+
+def write_table(
+    path: str, m: KLModel, layout: KLLayout, metric: int, keys: List[int], distances: 'array[int]'
+) -> None:
+    '''Write the table of the keys and their distances to path'''
+    size = layout.state_bytes
+    slot_size = size + 2
+    nb_slots = 1
+    while nb_slots * 3 < len(keys) * 5:
+        # keep the table less than 60% full
+        nb_slots *= 2
+    mask = nb_slots - 1
+    table = bytearray(b'\0' * size + _EMPTY_SLOT.to_bytes(2, 'little')) * nb_slots
+    for key, d in zip(keys, distances):
+        i = key_hash(key) & mask
+        while table[i * slot_size + size : (i + 1) * slot_size] != b'\xff\xff':
+            i = (i + 1) & mask
+        table[i * slot_size : (i + 1) * slot_size] = key.to_bytes(size, 'big') + d.to_bytes(2, 'little')
+
+    header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, metric, size, len(keys), nb_slots, m.digest.encode())
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(table)
+    os.replace(tmp, path)
+
+
+def build_table(
+    m: KLModel, metric: int = Metric.steps, directory: str = DEFAULT_TABLE_DIR, max_states: Optional[int] = None
+) -> Optional[str]:
+    '''Compute the table of the level of m and write it in directory. Return the path of the table,
+    or None if the level has more than max_states positions.'''
+    start = start_position(m)
+    layout = KLLayout(start)
+    result = retrograde_analysis(layout, metric, max_states)
+    if result is None:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, table_fname(m, metric))
+    write_table(path, start, layout, metric, *result)
+    return path
+
+
+class KLDistanceTable:
+    '''The distance table of a level, read from its file when first used'''
+
+    def __init__(self, path: str, m: KLModel) -> None:
+        self.path = path
+        self.layout = KLLayout(start_position(m))
+        self.digest = m.digest
+        self._file = None  # type: Any
+        self._map = None  # type: Optional[mmap.mmap]
+        self.metric = Metric.steps
+        self.positions = 0
+        self._mask = 0
+        self._key_size = 0
+        self._slot_size = 0
+
+    def open(self) -> None:
+        '''Map the file and check its header'''
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metric, key_size, positions, nb_slots, digest = TABLE_HEADER.unpack_from(self._map)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            self.close()
+            raise ValueError("%s is not a distance table of version %d" % (self.path, TABLE_VERSION))
+        if digest.decode() != self.digest or key_size != self.layout.state_bytes:
+            self.close()
+            raise ValueError("%s is the table of another level" % self.path)
+        self.metric = metric
+        self.positions = positions
+        self._mask = nb_slots - 1
+        self._key_size = key_size
+        self._slot_size = key_size + 2
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def distance(self, state: int) -> int:
+        '''Return the distance from state to a win, DEAD_END if the game can not be won from it,
+        UNKNOWN if state is not a position reachable from the start'''
+        if self._map is None:
+            self.open()
+        assert self._map is not None
+        key = self.layout.key(state)
+        target = key.to_bytes(self._key_size, 'big')
+        i = key_hash(key) & self._mask
+        while True:
+            offset = TABLE_HEADER.size + i * self._slot_size
+            d = int.from_bytes(self._map[offset + self._key_size : offset + self._slot_size], 'little')
+            if d == _EMPTY_SLOT:
+                return UNKNOWN
+            if self._map[offset : offset + self._key_size] == target:
+                return DEAD_END if d == NO_WIN else d
+            i = (i + 1) & self._mask
+
+    def distance_of(self, m: KLModel) -> int:
+        '''Return the distance to a win from the current position of m'''
+        return self.distance(self.layout.state_of(m))
+
+    def closer_states(self, state: int) -> List[int]:
+        '''Return the states reachable from state with one move of the metric of the table,
+        which are closer to a win'''
+        d = self.distance(state)
+        if d <= 0:
+            return []
+        return [t for t in expand(self.layout, state, self.metric) if self.distance(t) == d - 1]
+
+
+# tables already opened, by file name
+_tables = {}  # type: Dict[str, Optional[KLDistanceTable]]
+
+
+def load_table(
+    m: KLModel, metric: int = Metric.steps, directory: str = DEFAULT_TABLE_DIR
+) -> Optional[KLDistanceTable]:
+    '''Return the distance table of the level of m, or None if it was not built'''
+    fname = table_fname(m, metric)
+    if fname not in _tables:
+        path = os.path.join(directory, fname)
+        _tables[fname] = KLDistanceTable(path, m) if os.path.exists(path) else None
+    return _tables[fname]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Build the distance tables of the levels of a board file')
+    parser.add_argument('names', nargs='*', help='names of the levels, all of them by default')
+    parser.add_argument('--boards', default=str(pathlib.Path(__file__).parent / "boards.kts"),
+                        help='board file, boards.kts by default')
+    parser.add_argument('--metric', choices=['steps', 'moves'], default='steps')
+    parser.add_argument('--output', default=DEFAULT_TABLE_DIR, help='directory of the tables')
+    parser.add_argument('--max-states', type=int, default=None, help='skip the levels with more positions')
+    parser.add_argument('--force', action='store_true', help='build the tables which already exist again')
+    args = parser.parse_args()
+    metric = getattr(Metric, args.metric)
+
+    maps = load_maps(args.boards)
+    for level_id in sorted(maps):
+        m = maps[level_id]
+        if args.names and m.name not in args.names:
+            continue
+        if not args.force and os.path.exists(os.path.join(args.output, table_fname(m, metric))):
+            print("%-30s already built" % m.name)
+            continue
+        t0 = time.perf_counter()
+        path = build_table(m, metric, args.output, args.max_states)
+        if path is None:
+            print("%-30s skipped, more than %d positions" % (m.name, args.max_states))
+        else:
+            print("%-30s %s time=%.2fs" % (m.name, os.path.basename(path), time.perf_counter() - t0))
+
+
+if __name__ == '__main__':
+    main()
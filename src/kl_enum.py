@@ -7,13 +7,10 @@ License: Gnu GPL (see fname LICENSE)
 
 from typing import Dict, List
 
-from PyQt5.QtGui import qRgb
-from PyQt5.QtCore import Qt
-
 VERSION = '1.3.2'
 
 TILE_SIZE = 32
-TRANSP_COLOR = qRgb(0, 0, 0)
+TRANSP_COLOR = 0xFF000000  # qRgb(0, 0, 0)
 ID_SPLASH_SCREEN = 0
 NAME_SPLASH_SCREEN = 'Splash'
 
@@ -21,6 +18,8 @@ PIX_SIZE = TILE_SIZE // 2
 MINI_TILE_SIZE = 4
 
 TILE_FILE_NAME = "klotski-tiles.png"
+# mask of the transparent pixels of TILE_FILE_NAME, generated with it by pixmaps/generate_pix.py
+TILE_MASK_FILE_NAME = "klotski-tiles-mask.png"
 
 MSG_ABOUT = (
     """Klotski %s
@@ -78,14 +77,16 @@ class Tile:
     space = 5  # used only for mini tiles color
 
 
+# Colors are given as rgb values, so that this file does not depend on Qt.
+# They match Qt.yellow, Qt.red, Qt.gray, Qt.lightGray, Qt.darkRed and Qt.black
 mini_tile_colors = {
-    Tile.piece: Qt.yellow,
-    Tile.m_piece: Qt.red,
-    Tile.wall: Qt.gray,
-    Tile.s_wall: Qt.lightGray,
-    Tile.goal: Qt.darkRed,
-    Tile.space: Qt.black,
-}  # type: Dict[int, Qt.GlobalColor]
+    Tile.piece: 0xFFFF00,
+    Tile.m_piece: 0xFF0000,
+    Tile.wall: 0xA0A0A4,
+    Tile.s_wall: 0xC0C0C0,
+    Tile.goal: 0x800000,
+    Tile.space: 0x000000,
+}  # type: Dict[int, int]
 
 pix_list = ["corner", "hor_edge", "ver_edge", "miss_corner", "inner"]  # type: List[str]
 
@@ -0,0 +1,131 @@
+'''
+Hints for the player: the next move towards the solution of the current
+position.
+
+A hint comes from the distance table of the level when it was built (see
+kl_distance.py), or else from a search running on a thread of the Qt thread
+pool, so that the game never waits for it. A search is cancelled as soon as
+the player moves. Its result is kept for every position of the solution it
+found, so that asking again, or after an undo or a redo, costs nothing.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Dict, List, Tuple, Optional
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from .kl_model import KLModel, start_position
+from .kl_state import KLLayout
+from .kl_solver import Metric, Algorithm, solve_layout, state_path_to_moves
+from .kl_distance import load_table
+
+# maximum time of the search of a hint, in seconds. When it is not enough, the hint
+# is a move towards the position closest to the goals found by the search.
+HINT_MAX_TIME = 10.0
+
+
+def first_move(path: List[Tuple[str, Tuple[int, int]]]) -> List[Tuple[str, Tuple[int, int]]]:
+    '''Return the steps of path moving the same piece as the first one, a single move for the player'''
+    for i, (pid, _) in enumerate(path):
+        if pid != path[0][0]:
+            return path[:i]
+    return path
+
+
+class KLHintSignals(QObject):
+    # level digest, state, path found by the search, True when the path is a solution
+    sig_done = pyqtSignal(str, object, list, bool)
+
+
+class KLHintTask(QRunnable):
+    '''Search of the solution from a position, on a thread of the pool'''
+
+    def __init__(self, digest: str, state: int, layout: KLLayout, signals: KLHintSignals) -> None:
+        QRunnable.__init__(self)
+        self.digest = digest
+        self.state = state
+        # layout of the current position, with the s_walls still present only
+        self.layout = layout
+        self.signals = signals
+        self.cancel = threading.Event()
+
+    def run(self) -> None:
+        sol = solve_layout(self.layout, Metric.steps, Algorithm.astar, max_time=HINT_MAX_TIME, cancel=self.cancel)
+        if not self.cancel.is_set():
+            self.signals.sig_done.emit(self.digest, self.state, sol.path, sol.solved)
+
+
+class KLHintEngine(QObject):
+    '''Computes the hints and keeps them by position'''
+
+    # steps of the hinted move, as a list of (pid, (dx, dy)), empty when no move was found
+    sig_hint = pyqtSignal(list)
+
+    def __init__(self, parent: Optional[QObject] = None) -> None:
+        QObject.__init__(self, parent)
+        # layouts of the start position of the levels, by level digest
+        self.layouts = {}  # type: Dict[str, KLLayout]
+        # hint of each position, by level digest and state
+        self.cache = {}  # type: Dict[Tuple[str, int], List[Tuple[str, Tuple[int, int]]]]
+        self.task = None  # type: Optional[KLHintTask]
+        # position whose hint is waited for
+        self.pending = None  # type: Optional[Tuple[str, int]]
+        self.signals = KLHintSignals()
+        self.signals.sig_done.connect(self.search_done)
+
+    def layout(self, m: KLModel) -> KLLayout:
+        '''Return the layout of the start of the level of m'''
+        if m.digest not in self.layouts:
+            self.layouts[m.digest] = KLLayout(start_position(m))
+        return self.layouts[m.digest]
+
+    def request(self, m: KLModel) -> None:
+        '''Ask for the hint of the current position of m, sig_hint is emitted when it is known'''
+        position = (m.digest, self.layout(m).state_of(m))
+        if position not in self.cache:
+            table = load_table(m)
+            if table is not None:
+                layout = self.layout(m)
+                closer = table.closer_states(position[1])
+                self.cache[position] = state_path_to_moves(layout, [position[1], closer[0]]) if closer else []
+
+        if position in self.cache:
+            self.cancel()
+            self.sig_hint.emit(self.cache[position])
+            return
+
+        if position == self.pending:
+            # already searching
+            return
+        self.cancel()
+        self.pending = position
+        self.task = KLHintTask(m.digest, position[1], KLLayout(m), self.signals)
+        QThreadPool.globalInstance().start(self.task)
+
+    def cancel(self) -> None:
+        '''Stop waiting for a hint, and stop its search'''
+        if self.task is not None:
+            self.task.cancel.set()
+            self.task = None
+        self.pending = None
+
+    def search_done(self, digest: str, state: int, path: List[Tuple[str, Tuple[int, int]]], solved: bool) -> None:
+        '''Keep the hint of the position searched, and give it if it is waited for'''
+        if solved:
+            # the rest of the solution is the solution of every position on the way
+            layout = self.layouts[digest]
+            s = state
+            for i, (pid, (dx, dy)) in enumerate(path):
+                if i == 0 or pid != path[i - 1][0]:
+                    self.cache[(digest, s)] = first_move(path[i:])
+                s = layout.move(s, pid, dx, dy)
+        elif path:
+            # a move towards the position closest to the goals found by the search
+            self.cache[(digest, state)] = first_move(path)
+
+        if self.pending == (digest, state):
+            self.task = None
+            self.pending = None
+            self.sig_hint.emit(self.cache.get((digest, state), []))
@@ -0,0 +1,568 @@
+'''
+KLModel is the internal structure used to store the info on the boards.
+
+This file does not depend on Qt, so that the boards can be loaded and
+played (checking moves, moving pieces, ...) by programs which do not
+display anything. The Qt flavor used by the GUI is KLMap, in kl_map.py .
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Tuple, Dict, List, Optional, Callable, TypeVar, NamedTuple, Iterable, Iterator
+import hashlib
+from functools import reduce
+
+from .kl_enum import Piece, is_piece
+from .kl_cache import read_cache, write_cache, CACHE_SUFFIX, CachedLevel
+
+# the four elementary moves of a piece
+MOVES = ((1, 0), (0, 1), (-1, 0), (0, -1))  # type: Tuple[Tuple[int, int], ...]
+
+# Description of a move, as returned by KLModel.move_piece():
+# - pid, dx, dy: the piece and how far it moved
+# - cells: the cells of the piece before the move
+# - vacated: the cells of the piece which are free after the move
+# - occupied: the cells which are covered by the piece after the move and were not before
+# - s_walls_removed: the s_walls which disappeared because the heart piece hit them
+KLMove = NamedTuple(
+    'KLMove',
+    [
+        ('pid', str),
+        ('dx', int),
+        ('dy', int),
+        ('cells', Tuple[Tuple[int, int], ...]),
+        ('vacated', Tuple[Tuple[int, int], ...]),
+        ('occupied', Tuple[Tuple[int, int], ...]),
+        ('s_walls_removed', Tuple[Tuple[int, int], ...]),
+    ],
+)
+
+# A position of the board, as returned by KLModel.position(): the rows of the xymap and the s_walls
+KLPosition = Tuple[Tuple[Tuple[str, ...], ...], Tuple[Tuple[int, int], ...]]
+
+
+class Mirror:
+    '''Reflections of a board'''
+
+    left_right = 1
+    top_bottom = 2
+    # left_right and top_bottom together, which is a half turn
+    both = left_right | top_bottom
+
+
+def mirror_xy(mirror: int, x: int, y: int, w: int, h: int) -> Tuple[int, int]:
+    '''Return the image of the cell x,y by a reflection of a board of size w x h'''
+    if mirror & Mirror.left_right:
+        x = w - 1 - x
+    if mirror & Mirror.top_bottom:
+        y = h - 1 - y
+    return x, y
+
+
+def label_pieces(xymap: List[List[str]]) -> Tuple[List[List[str]], Dict[str, List[Tuple[int, int]]]]:
+    '''Find the pieces of a grid: the connected groups of cells with the same piece id.
+
+    Return a new grid where each piece has its own id, and the cells of each piece. The first
+    piece found with a given id, scanning the rows from the top, keeps it. The next ones get the
+    id followed by its first letter as many times as needed to make it unique: a, aa, aaa, ...
+    xymap is not modified.'''
+    h = len(xymap)
+    w = len(xymap[0]) if h else 0
+    # union-find of the cells, by index y * w + x
+    parent = list(range(w * h))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for y in range(h):
+        row = xymap[y]
+        for x in range(w):
+            pid = row[x]
+            if not is_piece(pid):
+                continue
+            i = y * w + x
+            if x > 0 and row[x - 1] == pid:
+                parent[find(i)] = find(i - 1)
+            if y > 0 and xymap[y - 1][x] == pid:
+                ra, rb = find(i), find(i - w)
+                if ra != rb:
+                    parent[max(ra, rb)] = min(ra, rb)
+
+    new_xymap = [list(row) for row in xymap]
+    cells = {}  # type: Dict[str, List[Tuple[int, int]]]
+    new_pid_of = {}  # type: Dict[int, str]
+    # last id given to a piece for each id of the grid, the next free one can only be after it
+    last_pid = {}  # type: Dict[str, str]
+    for y in range(h):
+        for x in range(w):
+            pid = xymap[y][x]
+            if not is_piece(pid):
+                continue
+            root = find(y * w + x)
+            new_pid = new_pid_of.get(root)
+            if new_pid is None:
+                new_pid = last_pid.get(pid, pid)
+                while new_pid in cells:
+                    new_pid = new_pid + pid[0]
+                last_pid[pid] = new_pid
+                new_pid_of[root] = new_pid
+                cells[new_pid] = []
+            new_xymap[y][x] = new_pid
+            cells[new_pid].append((x, y))
+    return new_xymap, cells
+
+
+def build_move(
+    pid: str, dx: int, dy: int, cells: Tuple[Tuple[int, int], ...], s_walls_removed: Tuple[Tuple[int, int], ...]
+) -> KLMove:
+    '''Return the move of the piece pid with these cells by dx, dy, which removes s_walls_removed'''
+    before = set(cells)
+    after = set((x + dx, y + dy) for (x, y) in cells)
+    return KLMove(
+        pid,
+        dx,
+        dy,
+        cells,
+        tuple(c for c in cells if c not in after),
+        tuple(c for c in after if c not in before),
+        s_walls_removed,
+    )
+
+
+def merge_moves(first: KLMove, second: KLMove) -> KLMove:
+    '''Return a single move equivalent to first followed by second, which must move the same piece'''
+    assert first.pid == second.pid, "can not merge moves of different pieces"
+    dx, dy = first.dx + second.dx, first.dy + second.dy
+    return build_move(first.pid, dx, dy, first.cells, first.s_walls_removed + second.s_walls_removed)
+
+
+class KLModel:
+    def __init__(self) -> None:
+        self.xymap = []  # type: List[ List[str] ]
+        self.goal = []  # type: List[ Tuple[int,int] ]
+        self.s_wall = []  # type: List[ Tuple[int, int] ]
+
+        self.name = ""
+        self.w = -1
+        self.h = -1
+        self.menu_name = ""
+        self.pid_size = 1
+        self.orig_xymap = []  # type: List[ List[str] ]
+        self.orig_s_wall = []  # type: List[ Tuple[int, int] ]
+
+        # index of the moveable pieces, kept up to date on every move:
+        # - cells of each piece
+        # - bounding box of each piece, as (xmin, ymin, xmax, ymax)
+        # - for each direction, the cells of the piece on the edge facing that direction
+        # - shape of each piece, its cells relative to the top left corner of its bounding box, sorted
+        self.piece_cells = {}  # type: Dict[str, List[Tuple[int, int]]]
+        self.piece_bbox = {}  # type: Dict[str, Tuple[int, int, int, int]]
+        self.piece_edges = {}  # type: Dict[str, Dict[Tuple[int, int], List[Tuple[int, int]]]]
+        self.piece_shapes = {}  # type: Dict[str, Tuple[Tuple[int, int], ...]]
+
+        # reflections which leave the walls, goals and s_walls unchanged
+        self.mirrors = []  # type: List[int]
+
+        # hash of the start position, identifies the level in the files computed from it
+        self.digest = ""
+
+    def __repr__(self) -> str:
+        return self.to_string(self.xymap)
+
+    def to_string(self, m: List[List[str]]) -> str:
+        r = "xymap %s : %d x %d\n" % (self.name, self.w, self.h)
+        for row in m:
+            r = r + Piece.border
+            for i in row:
+                r = r + (' ' * self.pid_size + i)[-self.pid_size :]
+            r = r + Piece.border + '\n'
+        return r
+
+    def reset(self) -> None:
+        '''Reset the current xymap to its original value'''
+        for row, orig_row in zip(self.xymap, self.orig_xymap):
+            row[:] = orig_row
+        for p in self.orig_s_wall:
+            if p not in self.s_wall:
+                self.s_wall.append(p)
+                self.s_wall_restored(*p)
+        self.build_piece_index()
+
+    def position(self) -> KLPosition:
+        '''Return the current position, to come back to it later with set_position()'''
+        return tuple(tuple(row) for row in self.xymap), tuple(self.s_wall)
+
+    def set_position(self, position: KLPosition) -> None:
+        '''Come back to a position returned by position(). The s_wall signals are not emitted.'''
+        rows, s_walls = position
+        for row, saved_row in zip(self.xymap, rows):
+            row[:] = saved_row
+        self.s_wall[:] = s_walls
+        self.build_piece_index()
+
+    def build_piece_index(self) -> None:
+        '''Build the cells, bounding box and edges index of all the moveable pieces from the xymap'''
+        self.piece_cells = {}
+        for y in range(self.h):
+            for x in range(self.w):
+                pid = self.xymap[y][x]
+                if self.isPidMoveable(pid):
+                    self.piece_cells.setdefault(pid, []).append((x, y))
+
+        self.piece_bbox = {}
+        self.piece_edges = {}
+        self.piece_shapes = {}
+        for pid, cells in self.piece_cells.items():
+            xs = [c[0] for c in cells]
+            ys = [c[1] for c in cells]
+            xmin, ymin = min(xs), min(ys)
+            self.piece_bbox[pid] = (xmin, ymin, max(xs), max(ys))
+            self.piece_shapes[pid] = tuple(sorted((x - xmin, y - ymin) for (x, y) in cells))
+
+            cell_set = set(cells)
+            edges = {}  # type: Dict[Tuple[int, int], List[Tuple[int, int]]]
+            for d in MOVES:
+                edges[d] = [(x, y) for (x, y) in cells if (x + d[0], y + d[1]) not in cell_set]
+            self.piece_edges[pid] = edges
+
+    def shift_piece_index(self, pid: str, dx: int, dy: int) -> None:
+        '''Update the index of piece pid after it was moved by dx, dy'''
+        self.piece_cells[pid] = [(x + dx, y + dy) for (x, y) in self.piece_cells[pid]]
+        xmin, ymin, xmax, ymax = self.piece_bbox[pid]
+        self.piece_bbox[pid] = (xmin + dx, ymin + dy, xmax + dx, ymax + dy)
+        edges = self.piece_edges[pid]
+        for d in edges:
+            edges[d] = [(x + dx, y + dy) for (x, y) in edges[d]]
+
+    def pid(self, x: int, y: int) -> str:
+        '''Return the piece id located at x,y'''
+        if x < 0 or y < 0:
+            return Piece.none
+        if x >= self.w or y >= self.h:
+            return Piece.none
+        return self.xymap[y][x]
+
+    def isPidMoveable(self, pid: str) -> bool:
+        return (pid == Piece.heart or is_piece(pid))
+
+
+    def canMove(self, pid: str, dx: int, dy: int) -> bool:
+        if abs(dx) + abs(dy) != 1:
+            raise ValueError("test of illegal move")
+
+        if not self.isPidMoveable(pid):
+            return False
+
+        # only the cells on the edge facing the move can hit something,
+        # the other ones move onto the piece itself
+        if pid not in self.piece_edges:
+            return True
+
+        for x, y in self.piece_edges[pid][(dx, dy)]:
+            move_id = self.pid(x + dx, y + dy)
+
+            # moving outside the board is forbidden
+            if move_id == Piece.none:
+                return False
+
+            # moving through the door is ok for the heart piece
+            if move_id == Piece.s_wall and pid == Piece.heart:
+                continue
+
+            # moving into space is ok
+            # moving into final goal is ok
+            if move_id == Piece.space or move_id == Piece.goal:
+                continue
+
+            # all other cases (moving onto other pieces) are forbidden
+            return False
+
+        return True
+
+    def move_piece(self, pid: str, deltaxy: Optional[Tuple[int, int]] = None) -> 'KLMove':
+        """Move the piece pid by delta_x, delta_y wrapped in deltaxy
+
+        If deltaxy is None, check of all possible moves and only move if one actual move is possible, else raises an exception.
+
+        The board is modified in place. The returned KLMove describes the changes, and can be
+        given to revert_move() to undo them or to apply_move() to perform them again.
+        """
+        if not (pid == Piece.heart or is_piece(pid)):
+            raise Exception(str(pid) + " is not a piece, can not move it")
+
+        if deltaxy is None:
+            pm = self.possibleMove(pid)
+            if len(pm) == 0:
+                raise Exception("No possible move")
+            if len(pm) > 1:
+                raise Exception("Too many possible move")
+            (dx, dy) = pm[0]
+        else:
+            dx, dy = deltaxy
+
+        cells = tuple(self.piece_cells[pid])
+        s_walls_removed = ()  # type: Tuple[Tuple[int, int], ...]
+        if pid == Piece.heart:
+            after = set((x + dx, y + dy) for (x, y) in cells)
+            s_walls_removed = tuple(p for p in self.s_wall if p in after)
+
+        move = build_move(pid, dx, dy, cells, s_walls_removed)
+        self.apply_move(move)
+        return move
+
+    def apply_move(self, move: 'KLMove') -> None:
+        '''Perform again a move returned by move_piece(), on the board where it was reverted'''
+        for x, y in move.vacated:
+            self.xymap[y][x] = Piece.space
+        for x, y in move.occupied:
+            self.xymap[y][x] = move.pid
+
+        for x, y in move.s_walls_removed:
+            # no longer a s_wall, even when a merged move carried the piece past it
+            self.s_wall_removed(x, y)
+            self.s_wall.remove((x, y))
+            if self.xymap[y][x] == Piece.s_wall:
+                self.xymap[y][x] = Piece.space
+
+        for x, y in move.vacated:
+            if (x, y) in self.goal:
+                self.xymap[y][x] = Piece.goal
+            elif (x, y) in self.s_wall:
+                self.xymap[y][x] = Piece.s_wall
+
+        self.shift_piece_index(move.pid, move.dx, move.dy)
+
+    def revert_move(self, move: 'KLMove') -> None:
+        '''Undo a move returned by move_piece(), including the s_walls it has removed'''
+        for p in move.s_walls_removed:
+            self.s_wall.append(p)
+            self.s_wall_restored(*p)
+
+        for x, y in move.occupied:
+            if (x, y) in self.goal:
+                self.xymap[y][x] = Piece.goal
+            elif (x, y) in self.s_wall:
+                self.xymap[y][x] = Piece.s_wall
+            else:
+                self.xymap[y][x] = Piece.space
+        for x, y in move.vacated:
+            self.xymap[y][x] = move.pid
+        for x, y in move.s_walls_removed:
+            # a merged move may have carried the piece past the s_wall
+            if (x, y) not in move.cells:
+                self.xymap[y][x] = Piece.s_wall
+
+        self.shift_piece_index(move.pid, -move.dx, -move.dy)
+
+    def s_wall_removed(self, x: int, y: int) -> None:
+        '''Called when the s_wall located at x,y is hit by the heart piece and disappears.
+
+        Does nothing, this is a hook for subclasses which need to be notified.'''
+        pass
+
+    def s_wall_restored(self, x: int, y: int) -> None:
+        '''Called when the s_wall located at x,y comes back, because a move is reverted or the board is reset.
+
+        Does nothing, this is a hook for subclasses which need to be notified.'''
+        pass
+
+    def possibleMove(self, pid: str) -> List[Tuple[int, int]]:
+        '''Return the list of allowed moves for a given piece'''
+        m = []  # type: List[ Tuple[int,int] ]
+        for move in MOVES:
+            if self.canMove(pid, move[0], move[1]):
+                m.append(move)
+        return m
+
+    def remove_doublon(self) -> None:
+        '''Give a different id to the pieces sharing the same id'''
+        self.xymap, cells = label_pieces(self.xymap)
+        self.pid_size = max([1] + [len(pid) for pid in cells])
+
+    def check(self, line_no: int) -> None:
+        """Check the general consistency of the current map.
+
+        Raises an exception in case of inconsistency.
+
+        Normally, all maps are correctly defined, exceptions should only be raised during
+        development of new maps.
+        """
+        try:
+            if len(self.name) == 0:
+                raise ValueError("No name for level")
+
+            if len(self.xymap) != self.h:
+                raise AssertionError(
+                    "xymap '%s' (line %d) has an inconsistent height %d." % (self.name, line_no, len(self.xymap))
+                )
+            for row in self.xymap:
+                if len(row) != self.w:
+                    raise AssertionError(
+                        "xymap '%s' (line %d) has a line with inconsistent width %d.\nKLMap was supposed to be of width %d"
+                        % (self.name, line_no, len(row), self.w)
+                    )
+
+            l = reduce(lambda x, y: x + y, self.xymap)
+            s = reduce(lambda x, y: x + y, l, '')
+            if -1 == s.find(Piece.heart) and self.name != "Icon":
+                raise ValueError("xymap %s has no heart piece" % self.name)
+
+            if -1 == s.find(Piece.goal) and self.name != "Icon":
+                raise ValueError("xymap %s has no goal" % self.name)
+        except (ValueError, AssertionError):
+            print(self)
+            raise
+
+    def is_game_won(self) -> bool:
+        '''Return True if the game is won'''
+        for p in self.goal:
+            if self.pid(p[0], p[1]) != Piece.heart:
+                return False
+        return True
+
+    def loadline(self, line_nb: int, name: str) -> None:
+        '''Fill the current xymap with one more line of data'''
+        self.h = len(self.xymap)
+        self.w = len(self.xymap[0])
+        self.name = name
+        self.check(line_nb)
+        self.remove_doublon()
+        self.init_level()
+        self.find_mirrors()
+        self.digest = hashlib.sha1('\n'.join(''.join(row) for row in self.orig_xymap).encode()).hexdigest()
+
+    def init_level(self) -> None:
+        '''Compute everything derived from the xymap of a level which was just loaded'''
+        self.goal = []
+        self.s_wall = []
+        for y in range(self.h):
+            for x in range(self.w):
+                if self.xymap[y][x] == Piece.goal:
+                    self.goal.append((x, y))
+                if self.xymap[y][x] == Piece.s_wall:
+                    self.s_wall.append((x, y))
+
+        self.orig_xymap = [list(row) for row in self.xymap]
+        self.orig_s_wall = list(self.s_wall)
+        self.build_piece_index()
+
+    def find_mirrors(self) -> None:
+        '''Fill self.mirrors with the reflections leaving the static part of the board unchanged'''
+        static = [
+            [pid if pid in (Piece.wall, Piece.goal, Piece.s_wall) else Piece.space for pid in row]
+            for row in self.orig_xymap
+        ]
+        self.mirrors = []
+        for mirror in (Mirror.left_right, Mirror.top_bottom, Mirror.both):
+            image = [[Piece.space] * self.w for _ in range(self.h)]
+            for y in range(self.h):
+                for x in range(self.w):
+                    mx, my = mirror_xy(mirror, x, y, self.w, self.h)
+                    image[my][mx] = static[y][x]
+            if image == static:
+                self.mirrors.append(mirror)
+
+
+def start_position(m: KLModel) -> KLModel:
+    '''Return a new KLModel with the start position of the level of m'''
+    start = KLModel()
+    start.xymap = [list(row) for row in m.orig_xymap]
+    start.loadline(0, m.name)
+    return start
+
+
+KLModelT = TypeVar('KLModelT', bound=KLModel)
+
+
+def level_of(m: KLModel) -> CachedLevel:
+    '''Return the level of m, as stored in a cache file'''
+    return m.name, m.pid_size, m.orig_xymap, m.mirrors, m.digest
+
+
+def model_from_level(level: CachedLevel, factory: Callable[[], KLModelT]) -> KLModelT:
+    '''Return a map object created with factory for a level returned by level_of(), at its start position'''
+    name, pid_size, grid, mirrors, level_digest = level
+    klmap = factory()
+    klmap.xymap = [list(row) for row in grid]
+    klmap.h = len(grid)
+    klmap.w = len(grid[0])
+    klmap.name = name
+    klmap.pid_size = pid_size
+    klmap.init_level()
+    klmap.mirrors = list(mirrors)
+    klmap.digest = level_digest
+    return klmap
+
+
+def load_maps_as(fname: str, factory: Callable[[], KLModelT]) -> Dict[int, KLModelT]:
+    '''Parses the file name to build a dictionnary of map id to map objects created with factory.
+
+    The levels are read from the binary cache of the file when it is up to date, else the cache
+    is built again.'''
+    with open(fname, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).digest()
+    cache_fname = fname + CACHE_SUFFIX
+    levels = read_cache(cache_fname, digest)
+    if levels is not None:
+        return {map_nb: model_from_level(level, factory) for map_nb, level in enumerate(levels)}
+
+    level_by_id = parse_maps(data.decode().splitlines(), factory)
+    levels = [level_of(m) for m in level_by_id.values()]
+    write_cache(cache_fname, digest, levels)
+    return level_by_id
+
+
+def parse_maps(lines: Iterable[str], factory: Callable[[], KLModelT]) -> Dict[int, KLModelT]:
+    '''Parses the lines of a board file to build a dictionnary of map id to map objects created with factory'''
+    return dict(enumerate(iter_maps(lines, factory)))
+
+
+def iter_maps(lines: Iterable[str], factory: Callable[[], KLModelT], line_nb: int = 0) -> Iterator[KLModelT]:
+    '''Parses the lines of a board file and yield the map objects created with factory, one by one,
+    as soon as their last line is read. line_nb is the number of the line before the first one.'''
+    intro = False
+    klmap = factory()
+    filling_map = False
+    map_line_nb = 0
+    map_name = ''
+
+    for l in lines:
+        line_nb = line_nb + 1
+        l = l.strip()
+        if not len(l):
+            continue
+
+        if l[0] == Piece.border and (l.rfind(Piece.border) != l.find(Piece.border)):
+            if not intro:
+                continue
+            filling_map = True
+            klmap.xymap.append(list(l[1 : l.rfind(Piece.border)]))
+            continue
+
+        if intro and filling_map:
+            klmap.loadline(map_line_nb, map_name)
+            yield klmap
+            klmap = factory()
+            filling_map = False
+            intro = False
+            map_name = ''
+
+        if l[0] == '<' and l[-1] == '>':
+            intro = True
+            map_name = l[1:-1]
+            filling_map = True
+            map_line_nb = line_nb
+            continue
+
+    if filling_map and intro:
+        klmap.loadline(map_line_nb, map_name)
+        yield klmap
+
+
+def load_maps(fname: str) -> Dict[int, KLModel]:
+    '''Parses the file name to build a dictionnary of map id to KLModel objects'''
+    return load_maps_as(fname, KLModel)
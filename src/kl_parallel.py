@@ -0,0 +1,264 @@
+'''
+Explore all the positions reachable from the start of a level, using several
+processes.
+
+The exploration is a breadth first search, one layer at a time. The visited
+states and the frontier are split between the workers: the state with key k
+belongs to the worker shard_of(k, nb_workers). For every layer, each worker
+expands the states of its frontier, sends the keys of their successors to
+the workers owning them, and keeps the ones it has never seen as its next
+frontier. The keys travel between the workers as packed byte buffers (see
+KLLayout.pack_bytes()), the levels are sent to the workers only once, as a
+KLLayout.
+
+Positions which differ only by swapping pieces of the same shape, or by a
+reflection of the board, are counted once (see KLLayout.key()).
+
+Run "python -m klotski.kl_parallel --help" to explore the levels of boards.kts
+or of another file.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Tuple, List, Set, Optional, Any
+import time, pathlib, argparse, os, traceback
+import multiprocessing
+
+from .kl_model import KLModel, load_maps
+from .kl_state import KLLayout, key_hash
+from .kl_solver import Metric, expand
+
+# time given to a worker to exit when the pool is closed, in seconds
+CLOSE_TIMEOUT = 5.0
+
+
+def shard_of(key: int, nb_workers: int) -> int:
+    '''Return the index of the worker owning key'''
+    return key_hash(key) % nb_workers
+
+
+class KLExploration:
+    '''Result of the exploration of a level'''
+
+    def __init__(self) -> None:
+        self.name = ''
+        # number of positions reachable from the start, including the start itself
+        self.positions = 0
+        # number of these positions where the game is won
+        self.winning = 0
+        # number of new positions found at each distance from the start, layers[0] is the start itself
+        self.layers = []  # type: List[int]
+        # distance from the start to the closest winning position, -1 if no position is winning
+        self.first_win = -1
+        # False when the exploration was stopped by max_states
+        self.complete = True
+        # number of states whose successors were generated
+        self.nodes_expanded = 0
+        self.workers = 0
+        # exploration time in seconds
+        self.elapsed = 0.0
+
+    @property
+    def depth(self) -> int:
+        '''Distance from the start to the farthest position'''
+        return len(self.layers) - 1
+
+    def __repr__(self) -> str:
+        return (
+            "KLExploration(name=%r, positions=%d, winning=%d, depth=%d, first_win=%d, complete=%s, "
+            "nodes_expanded=%d, workers=%d, elapsed=%.3f)"
+            % (
+                self.name,
+                self.positions,
+                self.winning,
+                self.depth,
+                self.first_win,
+                self.complete,
+                self.nodes_expanded,
+                self.workers,
+                self.elapsed,
+            )
+        )
+
+
+def _worker(index: int, nb_workers: int, commands: Any, inboxes: List[Any], results: Any) -> None:
+    '''Main loop of a worker process.
+
+    Commands are tuples:
+    - ('level', layout, metric): start the exploration of a new level
+    - ('layer',): expand the current frontier, report (index, new states, winning states, nodes expanded)
+    - ('stop',): exit
+    '''
+    layout = None  # type: Optional[KLLayout]
+    metric = Metric.steps
+    visited = set()  # type: Set[int]
+    frontier = []  # type: List[int]
+    try:
+        while True:
+            command = commands.get()
+            if command[0] == 'stop':
+                return
+
+            if command[0] == 'level':
+                _, layout, metric = command
+                start = layout.key(layout.start)
+                visited = set()
+                frontier = []
+                if shard_of(start, nb_workers) == index:
+                    visited.add(start)
+                    frontier.append(start)
+                continue
+
+            assert layout is not None
+            buckets = [set() for _ in range(nb_workers)]  # type: List[Set[int]]
+            for s in frontier:
+                for t in expand(layout, s, metric):
+                    t = layout.key(t)
+                    buckets[shard_of(t, nb_workers)].add(t)
+            nodes = len(frontier)
+
+            for j, bucket in enumerate(buckets):
+                inboxes[j].put(layout.pack_bytes(bucket))
+
+            # every worker sends exactly one buffer to every worker for each layer
+            frontier = []
+            for _ in range(nb_workers):
+                for t in layout.unpack_bytes(inboxes[index].get()):
+                    if t not in visited:
+                        visited.add(t)
+                        frontier.append(t)
+            winning = sum(1 for t in frontier if layout.is_won(t))
+            results.put((index, len(frontier), winning, nodes))
+    except Exception:
+        results.put((index, -1, 0, traceback.format_exc()))
+
+
+class KLParallelExplorer:
+    '''A pool of worker processes exploring levels one after the other.
+
+    Use it as a context manager, or call close() when done, to stop the workers.'''
+
+    def __init__(self, nb_workers: Optional[int] = None) -> None:
+        self.nb_workers = nb_workers or os.cpu_count() or 1
+        self.results = multiprocessing.Queue()  # type: Any
+        self.commands = [multiprocessing.Queue() for _ in range(self.nb_workers)]  # type: List[Any]
+        inboxes = [multiprocessing.Queue() for _ in range(self.nb_workers)]  # type: List[Any]
+        self.processes = [
+            multiprocessing.Process(
+                target=_worker, args=(i, self.nb_workers, self.commands[i], inboxes, self.results), daemon=True
+            )
+            for i in range(self.nb_workers)
+        ]
+        for p in self.processes:
+            p.start()
+
+    def __enter__(self) -> 'KLParallelExplorer':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        '''Stop the workers'''
+        for q in self.commands:
+            q.put(('stop',))
+        for p in self.processes:
+            p.join(CLOSE_TIMEOUT)
+        self.terminate()
+
+    def terminate(self) -> None:
+        '''Kill the workers still running, which may be waiting for a worker which failed'''
+        for p in self.processes:
+            if p.is_alive():
+                p.terminate()
+        for p in self.processes:
+            p.join()
+
+    def explore(self, m: KLModel, metric: int = Metric.steps, max_states: Optional[int] = None) -> KLExploration:
+        '''Explore all the positions reachable from the current position of m.
+
+        The exploration stops after the layer where more than max_states positions have been found.'''
+        t0 = time.perf_counter()
+        layout = KLLayout(m)
+        result = KLExploration()
+        result.name = m.name
+        result.workers = self.nb_workers
+        result.positions = 1
+        result.layers = [1]
+        if layout.is_won(layout.start):
+            result.winning = 1
+            result.first_win = 0
+
+        for q in self.commands:
+            q.put(('level', layout, metric))
+
+        while True:
+            if max_states is not None and result.positions > max_states:
+                result.complete = False
+                break
+            new, winning, nodes = self.run_layer()
+            result.nodes_expanded += nodes
+            if new == 0:
+                break
+            result.layers.append(new)
+            result.positions += new
+            result.winning += winning
+            if winning and result.first_win < 0:
+                result.first_win = len(result.layers) - 1
+
+        result.elapsed = time.perf_counter() - t0
+        return result
+
+    def run_layer(self) -> Tuple[int, int, int]:
+        '''Make all the workers expand their frontier, return the number of new states,
+        of new winning states and of expanded states'''
+        for q in self.commands:
+            q.put(('layer',))
+        new = winning = nodes = 0
+        for _ in range(self.nb_workers):
+            index, n, w, info = self.results.get()
+            if n < 0:
+                # the other workers wait for the states of this one, they can not go on
+                self.terminate()
+                raise RuntimeError("Worker %d failed:\n%s" % (index, info))
+            new += n
+            winning += w
+            nodes += info
+        return new, winning, nodes
+
+
+def explore(
+    m: KLModel, metric: int = Metric.steps, nb_workers: Optional[int] = None, max_states: Optional[int] = None
+) -> KLExploration:
+    '''Explore all the positions reachable from the current position of m with nb_workers processes,
+    by default one per cpu'''
+    with KLParallelExplorer(nb_workers) as explorer:
+        return explorer.explore(m, metric, max_states)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Explore all the positions of the levels of a board file')
+    parser.add_argument('names', nargs='*', help='names of the levels to explore, all of them by default')
+    parser.add_argument('--boards', default=str(pathlib.Path(__file__).parent / "boards.kts"),
+                        help='board file, boards.kts by default')
+    parser.add_argument('--metric', choices=['steps', 'moves'], default='steps')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, one per cpu by default')
+    parser.add_argument('--max-states', type=int, default=None, help='maximum number of positions for each level')
+    args = parser.parse_args()
+    metric = getattr(Metric, args.metric)
+
+    maps = load_maps(args.boards)
+    with KLParallelExplorer(args.workers) as explorer:
+        for level_id in sorted(maps):
+            m = maps[level_id]
+            if args.names and m.name not in args.names:
+                continue
+            r = explorer.explore(m, metric, args.max_states)
+            print(
+                "%-30s positions=%d winning=%d depth=%d first_win=%d complete=%s workers=%d time=%.2fs"
+                % (m.name, r.positions, r.winning, r.depth, r.first_win, r.complete, r.workers, r.elapsed)
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+Replay files: the moves played on a level, to watch them again later.
+
+A replay holds the digest of its level (see KLModel.digest), so that it is
+never played on another level or on a modified version of it, and every
+step of the game: the move of a piece by one cell. A step is packed in one
+byte, the index of the piece in the table of the pieces of the replay and
+the direction of the step, or two bytes when there are more than 64 pieces.
+
+Format, all integers little endian:
+- header: magic, REPLAY_VERSION (H), digest of the level (40 ascii bytes)
+- name of the level: length (H) then utf-8 bytes
+- steps, as packed by pack_steps():
+    - number of steps (I), bytes per step (B)
+    - table of the pieces: number of pieces (H), then each one: length (B) then utf-8 bytes
+    - each step: (index of the piece << 2 | index of the direction in DIRECTIONS), big endian
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import List, Tuple, Dict
+import os, struct
+
+# change it when the format of the replays changes
+REPLAY_VERSION = 2
+REPLAY_MAGIC = b'KLRP'
+REPLAY_SUFFIX = '.klr'
+
+_HEADER = struct.Struct('<4sH40s')
+_STEPS = struct.Struct('<IB')
+
+# the directions of the steps
+DIRECTIONS = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+
+# pid and direction of a step
+Step = Tuple[str, Tuple[int, int]]
+
+
+def pack_steps(steps: List[Step]) -> bytes:
+    '''Return the bytes of the steps in a replay file'''
+    pids = {}  # type: Dict[str, int]
+    for pid, _ in steps:
+        pids.setdefault(pid, len(pids))
+    step_bytes = 1 if len(pids) <= 64 else 2
+
+    chunks = [_STEPS.pack(len(steps), step_bytes), len(pids).to_bytes(2, 'little')]
+    for pid in pids:
+        encoded = pid.encode()
+        chunks.append(bytes([len(encoded)]) + encoded)
+
+    packed = bytearray()
+    for pid, d in steps:
+        if d not in DIRECTIONS:
+            raise ValueError("%s is not a step of one cell" % (d,))
+        packed += (pids[pid] << 2 | DIRECTIONS.index(d)).to_bytes(step_bytes, 'big')
+    chunks.append(bytes(packed))
+    return b''.join(chunks)
+
+
+def unpack_steps(data: bytes, offset: int) -> Tuple[List[Step], int]:
+    '''Return the steps packed by pack_steps() at offset in data, and the offset after it'''
+    nb_steps, step_bytes = _STEPS.unpack_from(data, offset)
+    offset += _STEPS.size
+    pids = []
+    nb_pids = int.from_bytes(data[offset : offset + 2], 'little')
+    offset += 2
+    for _ in range(nb_pids):
+        size = data[offset]
+        pids.append(data[offset + 1 : offset + 1 + size].decode())
+        offset += 1 + size
+
+    # the step of each code, shared by all the steps with this code
+    codes = [(pid, d) for pid in pids for d in DIRECTIONS]
+    end = offset + nb_steps * step_bytes
+    if end > len(data):
+        raise IndexError("truncated steps")
+    if step_bytes == 1:
+        steps = [codes[code] for code in data[offset:end]]
+    else:
+        steps = [codes[data[i] << 8 | data[i + 1]] for i in range(offset, end, 2)]
+    return steps, end
+
+
+def write_replay(fname: str, digest: str, name: str, steps: List[Step]) -> None:
+    '''Write the steps played on the level with this digest and name to the replay file fname'''
+    encoded = name.encode()
+    chunks = [
+        _HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, digest.encode('ascii')),
+        len(encoded).to_bytes(2, 'little') + encoded,
+        pack_steps(steps),
+    ]
+    tmp = fname + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(b''.join(chunks))
+    os.replace(tmp, fname)
+
+
+def read_replay(fname: str) -> Tuple[str, str, List[Step]]:
+    '''Return the digest and name of the level of the replay file fname, and its steps'''
+    with open(fname, 'rb') as f:
+        data = f.read()
+
+    try:
+        magic, version, digest = _HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError("%s is not a replay of version %d" % (fname, REPLAY_VERSION))
+        offset = _HEADER.size
+        size = int.from_bytes(data[offset : offset + 2], 'little')
+        name = data[offset + 2 : offset + 2 + size].decode()
+        offset += 2 + size
+        steps, offset = unpack_steps(data, offset)
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise ValueError("%s is not a valid replay" % fname)
+    if offset != len(data):
+        raise ValueError("%s is not a valid replay" % fname)
+    return digest.decode('ascii'), name, steps
@@ -0,0 +1,137 @@
+'''
+Snapshots of a game: the level, the current position and the move list, to
+resume the game later exactly where it was left.
+
+A snapshot holds the level itself, in the format of the cache of the board
+files (see kl_cache.py) with its digest, so that it is restored without
+reading any board file, even when the level was modified or removed since.
+The moves are stored as the steps of a replay (see kl_replay.py): the
+entries of the move list are the runs of steps of the same piece, since two
+consecutive entries never move the same piece. The current position is
+stored too, so that restoring a snapshot does not play any move.
+
+Format, all integers little endian:
+- header: magic, SNAPSHOT_VERSION (H), index of the current entry of the move list (i)
+- level, as packed by kl_cache.pack_level()
+- current position: grid as packed by kl_cache.pack_grid(), number of s_walls (H),
+  then each s_wall: x (H), y (H)
+- steps of the move list, as packed by kl_replay.pack_steps()
+- s_walls removed by the entries of the move list: number of entries removing s_walls (I), then
+  for each one: index of the entry (I), number of s_walls (H), then each s_wall: x (H), y (H)
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import List, Tuple, Dict, Sequence, NamedTuple
+from itertools import groupby
+from operator import itemgetter
+import os, struct
+
+from .kl_cache import CachedLevel, pack_level, unpack_level, pack_grid, unpack_grid
+from .kl_model import KLPosition
+from .kl_replay import Step, pack_steps, unpack_steps
+
+# change it when the format of the snapshots changes
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAGIC = b'KLSN'
+SNAPSHOT_SUFFIX = '.kls'
+
+_HEADER = struct.Struct('<4sHi')
+_CELL = struct.Struct('<HH')
+
+# A game, as saved in a snapshot:
+# - level: the level, see kl_model.level_of()
+# - position: the current position, see KLModel.position()
+# - move_index: index of the current entry of the move list, -1 at the start of the level
+# - move_steps: steps of each entry of the move list
+# - s_walls_removed: s_walls removed by the entries of the move list, by index, for the entries removing some
+KLSnapshot = NamedTuple(
+    'KLSnapshot',
+    [
+        ('level', CachedLevel),
+        ('position', KLPosition),
+        ('move_index', int),
+        ('move_steps', Sequence[Sequence[Step]]),
+        ('s_walls_removed', Dict[int, Tuple[Tuple[int, int], ...]]),
+    ],
+)
+
+
+def pack_cells(cells: Sequence[Tuple[int, int]]) -> bytes:
+    '''Return the number of cells followed by their coordinates'''
+    return len(cells).to_bytes(2, 'little') + b''.join(_CELL.pack(x, y) for x, y in cells)
+
+
+def unpack_cells(data: bytes, offset: int) -> Tuple[Tuple[Tuple[int, int], ...], int]:
+    '''Return the cells packed by pack_cells() at offset in data, and the offset after it'''
+    nb_cells = int.from_bytes(data[offset : offset + 2], 'little')
+    offset += 2
+    cells = tuple(_CELL.unpack_from(data, offset + i * _CELL.size) for i in range(nb_cells))
+    return cells, offset + nb_cells * _CELL.size
+
+
+def pack_snapshot(snapshot: KLSnapshot) -> bytes:
+    '''Return the content of the snapshot file of a game'''
+    rows, s_walls = snapshot.position
+    chunks = [
+        _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, snapshot.move_index),
+        pack_level(snapshot.level),
+        pack_grid([list(row) for row in rows]),
+        pack_cells(s_walls),
+        pack_steps([step for steps in snapshot.move_steps for step in steps]),
+        len(snapshot.s_walls_removed).to_bytes(4, 'little'),
+    ]
+    for i, cells in sorted(snapshot.s_walls_removed.items()):
+        chunks.append(i.to_bytes(4, 'little') + pack_cells(cells))
+    return b''.join(chunks)
+
+
+def unpack_snapshot(data: bytes) -> KLSnapshot:
+    '''Return the game of the content of a snapshot file. Raise ValueError if it is not valid.'''
+    try:
+        magic, version, move_index = _HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("not a snapshot of version %d" % SNAPSHOT_VERSION)
+        offset = _HEADER.size
+        level, offset = unpack_level(data, offset)
+        grid = level[2]
+        rows, offset = unpack_grid(data, offset, len(grid[0]), len(grid))
+        s_walls, offset = unpack_cells(data, offset)
+        steps, offset = unpack_steps(data, offset)
+
+        # an entry of the move list for each run of steps of the same piece
+        move_steps = [list(run) for _, run in groupby(steps, itemgetter(0))]  # type: List[List[Step]]
+
+        s_walls_removed = {}  # type: Dict[int, Tuple[Tuple[int, int], ...]]
+        nb_removed = int.from_bytes(data[offset : offset + 4], 'little')
+        offset += 4
+        for _ in range(nb_removed):
+            i = int.from_bytes(data[offset : offset + 4], 'little')
+            if i >= len(move_steps):
+                raise ValueError("not a valid snapshot")
+            s_walls_removed[i], offset = unpack_cells(data, offset + 4)
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise ValueError("not a valid snapshot")
+    if offset != len(data) or not -1 <= move_index < len(move_steps):
+        raise ValueError("not a valid snapshot")
+    position = (tuple(tuple(row) for row in rows), s_walls)
+    return KLSnapshot(level, position, move_index, move_steps, s_walls_removed)
+
+
+def write_snapshot(fname: str, snapshot: KLSnapshot) -> None:
+    '''Write the snapshot of a game to the file fname'''
+    data = pack_snapshot(snapshot)
+    tmp = fname + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, fname)
+
+
+def read_snapshot(fname: str) -> KLSnapshot:
+    '''Return the game saved in the snapshot file fname. Raise ValueError if it is not valid.'''
+    with open(fname, 'rb') as f:
+        data = f.read()
+    try:
+        return unpack_snapshot(data)
+    except ValueError as e:
+        raise ValueError("%s: %s" % (fname, e))
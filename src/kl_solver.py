@@ -0,0 +1,432 @@
+'''
+Find the shortest solution of a board.
+
+The search works on the packed states of KLLayout, it does not need Qt and
+does not create any KLModel while searching. Positions which differ only by
+swapping pieces of the same shape are stored once, under their canonical key.
+
+Two metrics are available:
+- Metric.steps: every move of a piece by one cell counts as one
+- Metric.moves: consecutive moves of the same piece count as one, like in
+  the move counter of the game
+
+Three algorithms are available:
+- Algorithm.bfs: breadth first search, stores every state reached
+- Algorithm.astar: A*, guided by the distance of the heart piece to the goals
+- Algorithm.idastar: iterative deepening A*, uses memory only for the current path
+
+All of them accept a node budget and a time budget. When a budget is exhausted,
+the search stops and returns the path to the state closest to the goals.
+
+Run "python -m klotski.kl_solver --help" to solve the levels of boards.kts .
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Tuple, Dict, List, Optional, Callable, Iterator
+import time, pathlib, heapq, argparse, threading
+
+from .kl_model import KLModel, load_maps
+from .kl_state import KLLayout
+
+
+class Metric:
+    steps = 0
+    moves = 1
+
+
+class Algorithm:
+    bfs = 0
+    astar = 1
+    idastar = 2
+
+
+class KLSolution:
+    '''Result of a search'''
+
+    def __init__(self) -> None:
+        # True if a solution was found
+        self.solved = False
+        # the solution, as a list of moves of one cell: (pid, (dx, dy))
+        self.path = []  # type: List[ Tuple[str, Tuple[int, int]] ]
+        # number of states whose successors were generated
+        self.nodes_expanded = 0
+        # maximum number of states stored at the same time during the search
+        self.peak_states = 0
+        # search time in seconds
+        self.elapsed = 0.0
+        # when not solved, estimated distance to the goals at the end of path
+        self.remaining = 0
+
+    @property
+    def steps(self) -> int:
+        '''Length of the solution in moves of one cell'''
+        return len(self.path)
+
+    @property
+    def moves(self) -> int:
+        '''Length of the solution, consecutive moves of the same piece counting as one'''
+        return count_moves(self.path)
+
+    def __repr__(self) -> str:
+        return (
+            "KLSolution(solved=%s, steps=%d, moves=%d, remaining=%d, nodes_expanded=%d, peak_states=%d, elapsed=%.3f)"
+            % (
+                self.solved,
+                self.steps,
+                self.moves,
+                self.remaining,
+                self.nodes_expanded,
+                self.peak_states,
+                self.elapsed,
+            )
+        )
+
+
+def count_moves(path: List[Tuple[str, Tuple[int, int]]]) -> int:
+    '''Count the moves of a path, consecutive moves of the same piece counting as one'''
+    nb = 0
+    last_pid = None  # type: Optional[str]
+    for pid, _ in path:
+        if pid != last_pid:
+            nb += 1
+            last_pid = pid
+    return nb
+
+
+def expand(layout: KLLayout, state: int, metric: int) -> List[int]:
+    '''Return the states reachable from state with one move of the metric'''
+    if metric == Metric.steps:
+        return [s for _, _, s in layout.successors(state)]
+    result = []  # type: List[int]
+    for i in range(len(layout.pids)):
+        result.extend(layout.piece_successors(state, i))
+    return result
+
+
+def heart_distances(layout: KLLayout) -> Dict[int, int]:
+    '''Return the number of steps needed by the heart to cover the goals from each of its anchors,
+    if all the other pieces were removed. The heart goes through the s_walls, only the walls stop it.'''
+    if layout.heart_index < 0:
+        return {}
+    shape = layout.shapes[layout.heart_index]
+    dist = {}  # type: Dict[int, int]
+    todo = [a for a in layout.winning_anchors if (shape << a) & layout.wall_mask == 0]
+    for a in todo:
+        dist[a] = 0
+    d = 0
+    while todo:
+        d += 1
+        next_todo = []
+        for a in todo:
+            for _, _, shift in layout.moves:
+                b = a + shift
+                if b < 0 or b in dist or (shape << b) & layout.wall_mask:
+                    continue
+                dist[b] = d
+                next_todo.append(b)
+        todo = next_todo
+    return dist
+
+
+def make_heuristic(layout: KLLayout, metric: int) -> Callable[[int], int]:
+    '''Return an admissible estimate of the distance from a state to the goals'''
+    if layout.heart_index < 0:
+        return lambda state: 0
+
+    offset = len(layout.s_walls) + layout.heart_index * layout.anchor_bits
+    field = layout.anchor_field
+    if metric == Metric.moves:
+        # a single move of the heart may be enough
+        winning = layout.winning_anchors
+        return lambda state: 0 if (state >> offset) & field in winning else 1
+
+    dist = heart_distances(layout)
+    unreachable = len(dist) + 1
+
+    def h(state: int) -> int:
+        return dist.get((state >> offset) & field, unreachable)
+
+    return h
+
+
+class Budget:
+    '''Node and time budget of a search, which can also be cancelled from another thread'''
+
+    def __init__(
+        self, max_nodes: Optional[int], max_time: Optional[float], cancel: Optional[threading.Event] = None
+    ) -> None:
+        self.max_nodes = max_nodes
+        self.deadline = None if max_time is None else time.perf_counter() + max_time
+        self.cancel = cancel
+
+    def exhausted(self, nodes: int) -> bool:
+        if self.max_nodes is not None and nodes >= self.max_nodes:
+            return True
+        # checking the time is slow, do it every 256 nodes only
+        if nodes & 0xFF:
+            return False
+        if self.cancel is not None and self.cancel.is_set():
+            return True
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+
+def state_path_to_moves(layout: KLLayout, states: List[int]) -> List[Tuple[str, Tuple[int, int]]]:
+    '''Convert a list of states, each one reachable from the previous one by moving
+    a single piece, into a list of moves of one cell'''
+    path = []  # type: List[ Tuple[str, Tuple[int, int]] ]
+    for s, t in zip(states, states[1:]):
+        anchors_s, _ = layout.unpack(s)
+        anchors_t, _ = layout.unpack(t)
+        i = [a != b for a, b in zip(anchors_s, anchors_t)].index(True)
+        for j in layout.piece_successors(s, i)[t]:
+            dx, dy, _ = layout.moves[j]
+            path.append((layout.pids[i], (dx, dy)))
+    return path
+
+
+def parents_to_path(parents: Dict[int, int], key: int) -> List[int]:
+    '''Return the list of keys from the start of the search to key'''
+    keys = []
+    while key >= 0:
+        keys.append(key)
+        key = parents[key]
+    keys.reverse()
+    return keys
+
+
+def keys_to_states(layout: KLLayout, keys: List[int], metric: int) -> List[int]:
+    '''Convert a list of keys, each one reachable from the previous one, into the list of
+    concrete states reached from the start of the layout, with the actual piece ids'''
+    states = [layout.start]
+    for k in keys[1:]:
+        for t in expand(layout, states[-1], metric):
+            if layout.key(t) == k:
+                states.append(t)
+                break
+        else:
+            raise AssertionError("key %d is not reachable from the previous state" % k)
+    return states
+
+
+def solve(
+    m: KLModel,
+    metric: int = Metric.steps,
+    algorithm: int = Algorithm.bfs,
+    max_states: Optional[int] = None,
+    max_nodes: Optional[int] = None,
+    max_time: Optional[float] = None,
+) -> KLSolution:
+    '''Return the shortest solution from the current position of m.
+
+    The search stops unsolved when more than max_states states are stored, when more than max_nodes
+    states are expanded or after max_time seconds. The path of the solution then leads to the state
+    closest to the goals which was reached.
+    '''
+    return solve_layout(KLLayout(m), metric, algorithm, max_states, max_nodes, max_time)
+
+
+def solve_layout(
+    layout: KLLayout,
+    metric: int = Metric.steps,
+    algorithm: int = Algorithm.bfs,
+    max_states: Optional[int] = None,
+    max_nodes: Optional[int] = None,
+    max_time: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+) -> KLSolution:
+    '''Return the shortest solution from the start of layout, see solve().
+
+    This function does not use any KLModel, it can run in another thread while the game goes on.
+    The search also stops when cancel is set.'''
+    t0 = time.perf_counter()
+    sol = KLSolution()
+    budget = Budget(max_nodes, max_time, cancel)
+    h = make_heuristic(layout, metric)
+
+    if algorithm == Algorithm.bfs:
+        keys = bfs(layout, metric, h, budget, max_states, sol)
+    elif algorithm == Algorithm.astar:
+        keys = astar(layout, metric, h, budget, max_states, sol)
+    elif algorithm == Algorithm.idastar:
+        keys = idastar(layout, metric, h, budget, sol)
+    else:
+        raise ValueError("Unknown algorithm: %d" % algorithm)
+
+    states = keys_to_states(layout, keys, metric)
+
+    sol.solved = layout.is_won(states[-1])
+    sol.remaining = h(states[-1])
+    sol.path = state_path_to_moves(layout, states)
+    sol.elapsed = time.perf_counter() - t0
+    return sol
+
+
+def bfs(
+    layout: KLLayout,
+    metric: int,
+    h: Callable[[int], int],
+    budget: Budget,
+    max_states: Optional[int],
+    sol: KLSolution,
+) -> List[int]:
+    '''Breadth first search, return the list of keys to the solution or to the best state found'''
+    start = layout.key(layout.start)
+    parents = {start: -1}  # type: Dict[int, int]
+    frontier = [start]
+    best = (h(start), start)
+    while frontier and best[0] > 0:
+        if max_states is not None and len(parents) > max_states:
+            break
+        next_frontier = []  # type: List[int]
+        for s in frontier:
+            if budget.exhausted(sol.nodes_expanded):
+                next_frontier = []
+                break
+            sol.nodes_expanded += 1
+            for t in expand(layout, s, metric):
+                t = layout.key(t)
+                if t in parents:
+                    continue
+                parents[t] = s
+                if layout.is_won(t):
+                    best = (0, t)
+                    break
+                best = min(best, (h(t), t))
+                next_frontier.append(t)
+            if best[0] == 0:
+                break
+        frontier = next_frontier
+
+    sol.peak_states = len(parents)
+    return parents_to_path(parents, best[1])
+
+
+def astar(
+    layout: KLLayout,
+    metric: int,
+    h: Callable[[int], int],
+    budget: Budget,
+    max_states: Optional[int],
+    sol: KLSolution,
+) -> List[int]:
+    '''A* search, return the list of keys to the solution or to the best state found'''
+    start = layout.key(layout.start)
+    parents = {start: -1}  # type: Dict[int, int]
+    g = {start: 0}  # type: Dict[int, int]
+    h0 = h(start)
+    # deeper states first among the states with the same estimate
+    opened = [(h0, 0, start)]
+    best = (h0, 0, start)
+    while opened:
+        f, minus_gs, s = heapq.heappop(opened)
+        gs = -minus_gs
+        if gs > g[s]:
+            # already reached with a shorter path
+            continue
+        if layout.is_won(s):
+            best = (0, 0, s)
+            break
+        if budget.exhausted(sol.nodes_expanded) or (max_states is not None and len(g) > max_states):
+            break
+
+        sol.nodes_expanded += 1
+        for t in expand(layout, s, metric):
+            t = layout.key(t)
+            gt = gs + 1
+            if t in g and g[t] <= gt:
+                continue
+            g[t] = gt
+            parents[t] = s
+            ht = h(t)
+            best = min(best, (ht, -gt, t))
+            heapq.heappush(opened, (gt + ht, -gt, t))
+
+    sol.peak_states = len(g)
+    return parents_to_path(parents, best[2])
+
+
+def idastar(layout: KLLayout, metric: int, h: Callable[[int], int], budget: Budget, sol: KLSolution) -> List[int]:
+    '''Iterative deepening A*, return the list of keys to the solution or to the best state found.
+
+    Only the current path is stored, so memory grows with the depth of the search only.'''
+    start = layout.key(layout.start)
+    best_path = [start]
+    best_h = h(start)
+    bound = best_h
+    infinite = 1 << 62
+
+    def children(key: int) -> Iterator[Tuple[int, int]]:
+        '''Return the keys of the successors of key with their estimate, most promising first'''
+        keys = set(layout.key(t) for t in expand(layout, key, metric))
+        return iter(sorted((h(k), k) for k in keys))
+
+    while best_h > 0:
+        path = [start]
+        on_path = {start}
+        stack = [children(start)]
+        next_bound = infinite
+        stopped = False
+        while stack:
+            try:
+                ht, t = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            if t in on_path:
+                continue
+
+            f = len(path) + ht
+            if f > bound:
+                next_bound = min(next_bound, f)
+                continue
+
+            if ht < best_h or (ht == best_h and len(path) + 1 < len(best_path)):
+                best_h = ht
+                best_path = path + [t]
+            if layout.is_won(t):
+                break
+
+            if budget.exhausted(sol.nodes_expanded):
+                stopped = True
+                break
+            sol.nodes_expanded += 1
+            path.append(t)
+            on_path.add(t)
+            stack.append(children(t))
+            sol.peak_states = max(sol.peak_states, len(path))
+
+        if stopped or best_h == 0 or next_bound == infinite:
+            break
+        bound = next_bound
+
+    return best_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Solve the levels of boards.kts')
+    parser.add_argument('names', nargs='*', help='names of the levels to solve, all of them by default')
+    parser.add_argument('--metric', choices=['steps', 'moves'], default='steps')
+    parser.add_argument('--algorithm', choices=['bfs', 'astar', 'idastar'], default='bfs')
+    parser.add_argument('--max-nodes', type=int, default=None, help='maximum number of nodes to expand')
+    parser.add_argument('--max-time', type=float, default=None, help='maximum time in seconds for each level')
+    args = parser.parse_args()
+    metric = getattr(Metric, args.metric)
+    algorithm = getattr(Algorithm, args.algorithm)
+
+    maps = load_maps(str(pathlib.Path(__file__).parent / "boards.kts"))
+    for level_id in sorted(maps):
+        m = maps[level_id]
+        if args.names and m.name not in args.names:
+            continue
+        sol = solve(m, metric, algorithm, max_nodes=args.max_nodes, max_time=args.max_time)
+        print(
+            "%-30s solved=%s steps=%d moves=%d remaining=%d nodes=%d peak=%d time=%.2fs"
+            % (m.name, sol.solved, sol.steps, sol.moves, sol.remaining, sol.nodes_expanded,
+               sol.peak_states, sol.elapsed)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+'''
+KLLayout describes the static part of a board (walls, goals, s_walls, shape of
+the pieces) and encodes the position of the pieces as a single integer, for
+the programs which explore many positions of a board (solver, analysis, ...).
+
+A position, or state, packs:
+- the s_walls still present, one bit per s_wall of the layout, in the lowest bits
+- then the anchor of every piece, in the order of KLLayout.pids
+
+The anchor of a piece is the index of the top left corner of its bounding box,
+on the padded grid used by KLBitMap: the cell x, y is the bit (y + 1) * stride + x .
+
+Pieces with the same shape are interchangeable: swapping two of them gives the
+same position for the player. KLLayout.key() returns a canonical form of a
+state, where the anchors of the pieces of the same shape are sorted, so that
+all these positions share the same key. A key is itself a valid state.
+
+When a reflection of the board leaves the walls, goals, s_walls and the set of
+piece shapes unchanged, a position and its reflection are equivalent too, and
+key() returns the same key for both of them.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Tuple, Dict, List, Set, Optional, Iterable
+
+from .kl_enum import Piece
+from .kl_model import KLModel, MOVES, Mirror, mirror_xy
+from .kl_bitboard import shift_mask, iter_bits
+
+
+def key_hash(key: int) -> int:
+    '''Return a hash of a key, spreading the keys evenly even in its low bits'''
+    # the low bits of a key vary little from one state to the next, mix them with a multiplicative hash
+    return (key * 0x9E3779B97F4A7C15) >> 32
+
+
+class KLLayout:
+    def __init__(self, m: KLModel) -> None:
+        '''Build the layout from the current position of m'''
+        self.name = m.name
+        self.w = m.w
+        self.h = m.h
+        self.stride = m.w + 1
+
+        board = 0
+        self.wall_mask = 0  # walls and padding
+        self.goal_mask = 0
+        for y in range(m.h):
+            for x in range(m.w):
+                board |= self.bit(x, y)
+                if m.pid(x, y) == Piece.wall:
+                    self.wall_mask |= self.bit(x, y)
+        self.wall_mask |= ((1 << ((m.h + 2) * self.stride)) - 1) & ~board
+        for x, y in m.goal:
+            self.goal_mask |= self.bit(x, y)
+
+        # s_walls present in the position m, the other ones are spaces for good
+        self.s_walls = sorted(m.s_wall)  # type: List[Tuple[int, int]]
+        self.s_wall_bits = [self.bit(x, y) for (x, y) in self.s_walls]
+        self.s_wall_field = (1 << len(self.s_walls)) - 1
+
+        shape_of = {}  # type: Dict[str, int]
+        for pid, cells in m.piece_cells.items():
+            xmin, ymin, _, _ = m.piece_bbox[pid]
+            shape = 0
+            for x, y in cells:
+                shape |= 1 << ((y - ymin) * self.stride + (x - xmin))
+            shape_of[pid] = shape
+
+        # heart first, then the other pieces grouped by shape
+        self.pids = sorted(shape_of.keys(), key=lambda pid: (pid != Piece.heart, shape_of[pid], pid))
+        self.heart_index = self.pids.index(Piece.heart) if Piece.heart in self.pids else -1
+        self.shapes = [shape_of[pid] for pid in self.pids]
+        start_anchors = [self.anchor_index(*m.piece_bbox[pid][:2]) for pid in self.pids]
+
+        # shape classes: the range of piece indices of each shape, the heart being alone in its class
+        self.classes = []  # type: List[Tuple[int, int]]
+        start = 0
+        for i in range(1, len(self.pids) + 1):
+            if i == len(self.pids) or i - 1 == self.heart_index or self.shapes[i] != self.shapes[start]:
+                self.classes.append((start, i))
+                start = i
+        self.class_of = [0] * len(self.pids)
+        for c, (start, end) in enumerate(self.classes):
+            for i in range(start, end):
+                self.class_of[i] = c
+        # classes with more than one piece, which need sorting for the key
+        self._interchangeable = [(start, end) for (start, end) in self.classes if end - start > 1]
+
+        # width and height of each piece
+        self.sizes = []  # type: List[Tuple[int, int]]
+        for shape in self.shapes:
+            cells = [divmod(idx, self.stride) for idx in iter_bits(shape)]
+            self.sizes.append((max(x for _, x in cells) + 1, max(y for y, _ in cells) + 1))
+
+        # reflections folding positions together: for each one, the index where the image of
+        # every piece goes with the table of the images of its anchors, and the image of every s_wall
+        self.mirrors = []  # type: List[Tuple[int, List[Tuple[int, Dict[int, int]]], List[int]]]
+        for mirror in m.mirrors:
+            class_images = self.mirror_classes(mirror)
+            s_wall_images = [
+                self.s_walls.index(p) if p in self.s_walls else -1
+                for p in (mirror_xy(mirror, x, y, self.w, self.h) for (x, y) in self.s_walls)
+            ]
+            if class_images is None or -1 in s_wall_images:
+                continue
+            targets = []  # type: List[Tuple[int, Dict[int, int]]]
+            for c, (start, end) in enumerate(self.classes):
+                dstart = self.classes[class_images[c]][0]
+                table = self.mirror_anchors(mirror, *self.sizes[start])
+                targets.extend((dstart + i - start, table) for i in range(start, end))
+            self.mirrors.append((mirror, targets, s_wall_images))
+
+        self.anchor_bits = max(1, ((self.h + 2) * self.stride).bit_length())
+        self.anchor_field = (1 << self.anchor_bits) - 1
+        # size of a state stored as bytes
+        self.state_bytes = max(1, (len(self.s_walls) + len(self.pids) * self.anchor_bits + 7) // 8)
+        self.start = self.pack(start_anchors, self.s_wall_field)
+        self.moves = [(dx, dy, dy * self.stride + dx) for (dx, dy) in MOVES]
+
+        # anchors of the heart where it covers all the goals
+        self.winning_anchors = set()  # type: Set[int]
+        if self.heart_index >= 0:
+            heart = self.shapes[self.heart_index]
+            for a in range((self.h + 2) * self.stride):
+                if self.goal_mask & ~(heart << a) == 0:
+                    self.winning_anchors.add(a)
+
+        # mask of the remaining s_walls, for every value of the s_wall field
+        self._s_wall_masks = {}  # type: Dict[int, int]
+
+    def bit(self, x: int, y: int) -> int:
+        '''Return the mask of the cell x,y'''
+        return 1 << self.anchor_index(x, y)
+
+    def anchor_index(self, x: int, y: int) -> int:
+        '''Return the index of the cell x,y on the padded grid'''
+        return (y + 1) * self.stride + x
+
+    def anchor_xy(self, anchor: int) -> Tuple[int, int]:
+        '''Return the cell x,y of an index on the padded grid'''
+        y, x = divmod(anchor, self.stride)
+        return x, y - 1
+
+    def s_wall_bits_under(self, mask: int) -> int:
+        '''Return the bits of the s_wall field for the s_walls covered by mask'''
+        bits = 0
+        for i, b in enumerate(self.s_wall_bits):
+            if mask & b:
+                bits |= 1 << i
+        return bits
+
+    def pack(self, anchors: List[int], s_walls: int) -> int:
+        '''Pack the anchors of the pieces and the s_wall field into a state'''
+        state = 0
+        for a in reversed(anchors):
+            state = (state << self.anchor_bits) | a
+        return (state << len(self.s_walls)) | s_walls
+
+    def unpack(self, state: int) -> Tuple[List[int], int]:
+        '''Return the anchors of the pieces and the s_wall field of a state'''
+        s_walls = state & self.s_wall_field
+        state >>= len(self.s_walls)
+        anchors = []
+        for _ in self.pids:
+            anchors.append(state & self.anchor_field)
+            state >>= self.anchor_bits
+        return anchors, s_walls
+
+    def pack_bytes(self, states: Iterable[int]) -> bytes:
+        '''Pack states into a buffer, state_bytes bytes each. The states are big endian,
+        so that the buffer of a sorted list of states is sorted bytewise too.'''
+        size = self.state_bytes
+        return b''.join(s.to_bytes(size, 'big') for s in states)
+
+    def unpack_bytes(self, buf: bytes) -> List[int]:
+        '''Return the states of a buffer created by pack_bytes()'''
+        size = self.state_bytes
+        view = memoryview(buf)
+        return [int.from_bytes(view[i : i + size], 'big') for i in range(0, len(view), size)]
+
+    def mirror_classes(self, mirror: int) -> Optional[List[int]]:
+        '''Return the image of every shape class by a reflection, or None if the reflection
+        of a shape is not the shape of a class with the same number of pieces'''
+        class_images = []
+        for c, (start, end) in enumerate(self.classes):
+            w, h = self.sizes[start]
+            image = 0
+            for idx in iter_bits(self.shapes[start]):
+                y, x = divmod(idx, self.stride)
+                x, y = mirror_xy(mirror, x, y, w, h)
+                image |= 1 << (y * self.stride + x)
+            for d, (dstart, dend) in enumerate(self.classes):
+                same_heart = (start == self.heart_index) == (dstart == self.heart_index)
+                if self.shapes[dstart] == image and dend - dstart == end - start and same_heart:
+                    class_images.append(d)
+                    break
+            else:
+                return None
+        return class_images
+
+    def mirror_anchors(self, mirror: int, w: int, h: int) -> Dict[int, int]:
+        '''Return the image by a reflection of every anchor of a piece of size w x h inside the board'''
+        table = {}
+        for y in range(self.h - h + 1):
+            for x in range(self.w - w + 1):
+                # the image of the top left corner is the top right or bottom left one
+                mx, my = mirror_xy(mirror, x, y, self.w, self.h)
+                if mirror & Mirror.left_right:
+                    mx -= w - 1
+                if mirror & Mirror.top_bottom:
+                    my -= h - 1
+                table[self.anchor_index(x, y)] = self.anchor_index(mx, my)
+        return table
+
+    def mirror(self, state: int, mirror: int) -> int:
+        '''Return the reflection of state, mirror must be one of the reflections of self.mirrors'''
+        for r, targets, s_wall_images in self.mirrors:
+            if r == mirror:
+                break
+        else:
+            raise ValueError("%d is not a reflection of the layout" % mirror)
+
+        anchors, s_walls = self.unpack(state)
+        return self.pack(*self._mirror(anchors, s_walls, targets, s_wall_images))
+
+    def _mirror(
+        self, anchors: List[int], s_walls: int, targets: List[Tuple[int, Dict[int, int]]], s_wall_images: List[int]
+    ) -> Tuple[List[int], int]:
+        '''Return the anchors and s_wall field of the reflection of a state'''
+        images = [0] * len(anchors)
+        for a, (j, table) in zip(anchors, targets):
+            images[j] = table[a]
+        image_s_walls = 0
+        for i in iter_bits(s_walls):
+            image_s_walls |= 1 << s_wall_images[i]
+        return images, image_s_walls
+
+    def _canonical(self, anchors: List[int], s_walls: int) -> int:
+        '''Sort the anchors of each shape class in place, and return the packed state'''
+        for start, end in self._interchangeable:
+            anchors[start:end] = sorted(anchors[start:end])
+        return self.pack(anchors, s_walls)
+
+    def canonical(self, state: int) -> int:
+        '''Return the canonical form of state, identical for all the states which differ only
+        by swapping pieces of the same shape'''
+        if not self._interchangeable:
+            return state
+        return self._canonical(*self.unpack(state))
+
+    def key(self, state: int) -> int:
+        '''Return the key of state, identical for all the states which differ only by swapping
+        pieces of the same shape or by a reflection of the board'''
+        if not self.mirrors:
+            return self.canonical(state)
+        anchors, s_walls = self.unpack(state)
+        keys = [self._canonical(*self._mirror(anchors, s_walls, targets, s_wall_images))
+                for _, targets, s_wall_images in self.mirrors]
+        return min(self._canonical(anchors, s_walls), *keys)
+
+    def state_of(self, m: KLModel) -> int:
+        '''Return the state of the current position of m, which must be a position of the level of the layout'''
+        anchors = [self.anchor_index(*m.piece_bbox[pid][:2]) for pid in self.pids]
+        s_walls = 0
+        for i, p in enumerate(self.s_walls):
+            if p in m.s_wall:
+                s_walls |= 1 << i
+        return self.pack(anchors, s_walls)
+
+    def canonical_moves(self, key: int) -> List[Tuple[int, int, int, int]]:
+        '''Return the moves of one cell from a canonical state, as a list of
+        (shape class, anchor of the moved piece, move index in self.moves, key of the new state)'''
+        anchors, _ = self.unpack(key)
+        return [(self.class_of[i], anchors[i], j, self.key(t)) for i, j, t in self.successors(key)]
+
+    def concrete_pid(self, state: int, shape_class: int, anchor: int) -> str:
+        '''Return the id of the piece of the shape class located at anchor in state. This maps
+        a move returned by canonical_moves() to the piece to move in a concrete position.'''
+        anchors, _ = self.unpack(state)
+        start, end = self.classes[shape_class]
+        return self.pids[anchors.index(anchor, start, end)]
+
+    def s_wall_mask(self, s_walls: int) -> int:
+        '''Return the mask of the s_walls still present for a given s_wall field'''
+        mask = self._s_wall_masks.get(s_walls)
+        if mask is None:
+            mask = 0
+            for i in iter_bits(s_walls):
+                mask |= self.s_wall_bits[i]
+            self._s_wall_masks[s_walls] = mask
+        return mask
+
+    def piece_masks(self, state: int) -> List[int]:
+        '''Return the mask of every piece in the state'''
+        anchors, _ = self.unpack(state)
+        return [shape << a for shape, a in zip(self.shapes, anchors)]
+
+    def is_won(self, state: int) -> bool:
+        '''Return True if the heart covers all the goals in the state'''
+        if self.heart_index < 0:
+            return self.goal_mask == 0
+        offset = len(self.s_walls) + self.heart_index * self.anchor_bits
+        return (state >> offset) & self.anchor_field in self.winning_anchors
+
+    def successors(self, state: int) -> List[Tuple[int, int, int]]:
+        '''Return all the states reachable from state by moving a piece by one cell,
+        as a list of (piece index, move index in self.moves, new state)'''
+        anchors, s_walls = self.unpack(state)
+        s_wall_mask = self.s_wall_mask(s_walls)
+        masks = [shape << a for shape, a in zip(self.shapes, anchors)]
+        occupancy = self.wall_mask | s_wall_mask
+        for m in masks:
+            occupancy |= m
+
+        result = []
+        offset = len(self.s_walls)
+        for i, m in enumerate(masks):
+            blocking = occupancy & ~m
+            if i == self.heart_index:
+                # moving through the door is ok for the heart piece
+                blocking &= ~s_wall_mask
+            for j, (_, _, shift) in enumerate(self.moves):
+                moved = m << shift if shift > 0 else m >> -shift
+                if moved & blocking:
+                    continue
+                new_state = state + (shift << offset)
+                if i == self.heart_index and moved & s_wall_mask:
+                    # the s_walls hit by the heart disappear
+                    new_state &= ~self.s_wall_bits_under(moved)
+                result.append((i, j, new_state))
+            offset += self.anchor_bits
+        return result
+
+    def move(self, state: int, pid: str, dx: int, dy: int) -> int:
+        '''Return the state reached by moving the piece pid by one cell dx, dy from state'''
+        i = self.pids.index(pid)
+        j = MOVES.index((dx, dy))
+        for k, l, t in self.successors(state):
+            if (k, l) == (i, j):
+                return t
+        raise ValueError("Illegal move of %s by %d,%d" % (pid, dx, dy))
+
+    def piece_successors(self, state: int, i: int) -> Dict[int, List[int]]:
+        '''Return all the states reachable from state by moving only the piece i, by any
+        number of cells. The result maps each state to the moves (index in self.moves)
+        leading to it. The state itself is not part of the result.'''
+        anchors, _ = self.unpack(state)
+        others = self.wall_mask
+        for j, (shape, a) in enumerate(zip(self.shapes, anchors)):
+            if j != i:
+                others |= shape << a
+        shape = self.shapes[i]
+        offset = len(self.s_walls) + i * self.anchor_bits
+        is_heart = i == self.heart_index
+
+        paths = {state: []}  # type: Dict[int, List[int]]
+        todo = [state]
+        while todo:
+            next_todo = []
+            for s in todo:
+                s_walls = s & self.s_wall_field
+                s_wall_mask = self.s_wall_mask(s_walls)
+                m = shape << ((s >> offset) & self.anchor_field)
+                blocking = others if is_heart else others | s_wall_mask
+                for j, (_, _, shift) in enumerate(self.moves):
+                    moved = shift_mask(m, shift)
+                    if moved & blocking:
+                        continue
+                    new_state = s + (shift << offset)
+                    if is_heart and moved & s_wall_mask:
+                        new_state &= ~self.s_wall_bits_under(moved)
+                    if new_state in paths:
+                        continue
+                    paths[new_state] = paths[s] + [j]
+                    next_todo.append(new_state)
+            todo = next_todo
+        del paths[state]
+        return paths
+
+    def to_grid(self, state: int) -> List[List[str]]:
+        '''Return the xymap of a state, with the piece ids of the layout'''
+        anchors, s_walls = self.unpack(state)
+        s_wall_mask = self.s_wall_mask(s_walls)
+        grid = []
+        for y in range(self.h):
+            row = []
+            for x in range(self.w):
+                b = self.bit(x, y)
+                if self.wall_mask & b:
+                    row.append(Piece.wall)
+                elif s_wall_mask & b:
+                    row.append(Piece.s_wall)
+                elif self.goal_mask & b:
+                    row.append(Piece.goal)
+                else:
+                    row.append(Piece.space)
+            grid.append(row)
+        for pid, shape, a in zip(self.pids, self.shapes, anchors):
+            for idx in iter_bits(shape << a):
+                x, y = self.anchor_xy(idx)
+                grid[y][x] = pid
+        return grid
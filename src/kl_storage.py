@@ -0,0 +1,350 @@
+'''
+Breadth first exploration of a level with the reached positions stored on disk,
+for the levels whose positions do not fit in memory.
+
+The keys of the positions (see KLLayout.key()) are stored in segment files,
+one per layer of the search: the segment of layer d holds the keys of all the
+positions at distance d from the start, sorted, as fixed size big endian
+records. A segment is written once and never modified, it is read through
+mmap, so that only the pages in use stay in memory.
+
+To compute a layer, the successors of the previous layer are collected in
+memory up to run_size keys, then written as sorted runs. The runs are merged
+into a single sorted stream, from which the keys already present in the
+segments are removed by a merge with the segments, giving the new segment.
+
+When the level has no s_walls, every move can be undone, so the successors
+of layer d can only be in the layers d - 1, d and d + 1: only the last two
+segments are checked. Otherwise all of them are.
+
+After each layer, the list of segments is saved in a manifest file of the
+directory. A search which was stopped resumes from its last complete layer
+when started again on the same directory.
+
+Run "python -m klotski.kl_storage --help" to explore levels this way.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
+import os, mmap, heapq, json, time, pathlib, argparse
+
+from .kl_model import KLModel, load_maps
+from .kl_state import KLLayout
+from .kl_solver import Metric, expand
+from .kl_parallel import KLExploration
+
+# change it when the format of the files changes
+STORAGE_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# number of records read at once when iterating over a segment
+READ_CHUNK = 1 << 14
+# maximum number of runs of a layer, they are merged into one when it is reached
+MAX_RUNS = 64
+
+
+class KLSegment:
+    '''A sorted segment file of states, each one state_bytes long, read through mmap'''
+
+    def __init__(self, path: str, state_bytes: int) -> None:
+        self.path = path
+        self.state_bytes = state_bytes
+        size = os.path.getsize(path)
+        if size % state_bytes:
+            raise ValueError("Truncated segment file: %s" % path)
+        self.count = size // state_bytes
+        self._file = None  # type: Any
+        self._map = None  # type: Optional[mmap.mmap]
+        # an empty file can not be mapped
+        if self.count:
+            self._file = open(path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record(self, i: int) -> bytes:
+        '''Return the record i, as bytes'''
+        assert self._map is not None
+        size = self.state_bytes
+        return self._map[i * size : (i + 1) * size]
+
+    def __getitem__(self, i: int) -> int:
+        return int.from_bytes(self.record(i), 'big')
+
+    def __iter__(self) -> Iterator[int]:
+        size = self.state_bytes
+        for start in range(0, self.count, READ_CHUNK):
+            end = min(self.count, start + READ_CHUNK)
+            assert self._map is not None
+            buf = self._map[start * size : end * size]
+            for i in range(0, len(buf), size):
+                yield int.from_bytes(buf[i : i + size], 'big')
+
+    def __contains__(self, state: object) -> bool:
+        if not isinstance(state, int) or not self.count:
+            return False
+        target = state.to_bytes(self.state_bytes, 'big')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.count and self.record(lo) == target
+
+
+def write_segment(path: str, states: Iterable[int], state_bytes: int) -> int:
+    '''Write states to path, and make sure that they are on disk. Return the number of states written.'''
+    count = 0
+    chunk = []  # type: List[bytes]
+    with open(path, 'wb') as f:
+        for s in states:
+            chunk.append(s.to_bytes(state_bytes, 'big'))
+            if len(chunk) == READ_CHUNK:
+                f.write(b''.join(chunk))
+                count += len(chunk)
+                chunk = []
+        f.write(b''.join(chunk))
+        count += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return count
+
+
+def merge_unique(*iterables: Iterable[int]) -> Iterator[int]:
+    '''Merge sorted iterables into a single sorted iterator without duplicates'''
+    last = -1
+    for s in heapq.merge(*iterables):
+        if s != last:
+            yield s
+            last = s
+
+
+def difference(states: Iterable[int], others: Iterable[int]) -> Iterator[int]:
+    '''Return the states which are not in others, both being sorted'''
+    it = iter(others)
+    other = next(it, None)
+    for s in states:
+        while other is not None and other < s:
+            other = next(it, None)
+        if other != s:
+            yield s
+
+
+class KLDiskSearch:
+    '''Breadth first exploration of the level of m, with the positions stored in directory'''
+
+    def __init__(self, m: KLModel, directory: str, metric: int = Metric.steps, run_size: int = 1 << 20) -> None:
+        self.layout = KLLayout(m)
+        self.directory = directory
+        self.metric = metric
+        self.run_size = run_size
+        self.result = KLExploration()
+        self.result.name = m.name
+        self.result.workers = 1
+        self.result.complete = False
+        self.segments = []  # type: List[KLSegment]
+        # number of winning positions of each layer
+        self.winning = []  # type: List[int]
+        # True when the successors of a layer are only in the previous, same and next layers
+        self.reversible = not self.layout.s_walls
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path(MANIFEST)):
+            self.resume()
+        else:
+            self.start()
+
+    def path(self, fname: str) -> str:
+        return os.path.join(self.directory, fname)
+
+    def start(self) -> None:
+        '''Write the first layer, with the start position only'''
+        start = self.layout.key(self.layout.start)
+        self.add_layer([start])
+
+    def resume(self) -> None:
+        '''Load the layers saved in the directory by a previous search'''
+        with open(self.path(MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest['version'] != STORAGE_VERSION:
+            raise ValueError("Unsupported storage version %s in %s" % (manifest['version'], self.directory))
+        if (
+            manifest['start'] != self.layout.key(self.layout.start)
+            or manifest['state_bytes'] != self.layout.state_bytes
+            or manifest['metric'] != self.metric
+        ):
+            raise ValueError("%s contains the search of another level or metric" % self.directory)
+
+        r = self.result
+        r.nodes_expanded = manifest['nodes_expanded']
+        r.complete = manifest['complete']
+        for layer in manifest['layers']:
+            self.segments.append(KLSegment(self.path(layer['file']), self.layout.state_bytes))
+            self.count_layer(layer['count'], layer['winning'])
+
+        # remove what a search stopped during a layer left behind
+        known = set(layer['file'] for layer in manifest['layers']) | {MANIFEST}
+        for fname in os.listdir(self.directory):
+            if fname not in known and (fname.endswith('.seg') or fname.endswith('.tmp')):
+                os.remove(self.path(fname))
+
+    def save_manifest(self) -> None:
+        '''Save the list of layers, replacing the previous manifest only when the new one is complete'''
+        r = self.result
+        manifest = {
+            'version': STORAGE_VERSION,
+            'name': r.name,
+            'start': self.layout.key(self.layout.start),
+            'state_bytes': self.layout.state_bytes,
+            'metric': self.metric,
+            'nodes_expanded': r.nodes_expanded,
+            'complete': r.complete,
+            'layers': [
+                {'file': os.path.basename(seg.path), 'count': seg.count, 'winning': winning}
+                for seg, winning in zip(self.segments, self.winning)
+            ],
+        }  # type: Dict[str, Any]
+        tmp = self.path(MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path(MANIFEST))
+
+    def count_layer(self, count: int, winning: int) -> None:
+        '''Add a layer to the result'''
+        r = self.result
+        self.winning.append(winning)
+        r.layers.append(count)
+        r.positions += count
+        r.winning += winning
+        if winning and r.first_win < 0:
+            r.first_win = len(r.layers) - 1
+
+    def add_layer(self, states: Iterable[int]) -> int:
+        '''Write the sorted states as the next layer and save the manifest, return the number of states'''
+        fname = 'layer-%05d.seg' % len(self.segments)
+        winning = [0]
+
+        def count_wins(states: Iterable[int]) -> Iterator[int]:
+            for s in states:
+                if self.layout.is_won(s):
+                    winning[0] += 1
+                yield s
+
+        tmp = self.path(fname + '.tmp')
+        count = write_segment(tmp, count_wins(states), self.layout.state_bytes)
+        if not count:
+            os.remove(tmp)
+            return 0
+        os.replace(tmp, self.path(fname))
+        self.segments.append(KLSegment(self.path(fname), self.layout.state_bytes))
+        self.count_layer(count, winning[0])
+        self.save_manifest()
+        return count
+
+    def successor_runs(self) -> Tuple[List[KLSegment], Set[int]]:
+        '''Return the successors of the last layer, as the segments of sorted runs written
+        to disk and the keys not written yet'''
+        runs = []  # type: List[KLSegment]
+        batch = set()  # type: Set[int]
+        for s in self.segments[-1]:
+            self.result.nodes_expanded += 1
+            for t in expand(self.layout, s, self.metric):
+                batch.add(self.layout.key(t))
+            if len(batch) >= self.run_size:
+                runs.append(self.write_run(len(runs), sorted(batch)))
+                batch = set()
+                if len(runs) == MAX_RUNS:
+                    merged = self.write_run(MAX_RUNS, merge_unique(*runs))
+                    for run in runs:
+                        run.close()
+                        os.remove(run.path)
+                    os.replace(merged.path, self.path('run-00000.tmp'))
+                    merged.path = self.path('run-00000.tmp')
+                    runs = [merged]
+        return runs, batch
+
+    def write_run(self, index: int, states: Iterable[int]) -> KLSegment:
+        '''Write a sorted run of successors'''
+        path = self.path('run-%05d.tmp' % index)
+        write_segment(path, states, self.layout.state_bytes)
+        return KLSegment(path, self.layout.state_bytes)
+
+    def next_layer(self) -> int:
+        '''Compute the next layer, return its number of positions'''
+        runs, batch = self.successor_runs()
+        candidates = merge_unique(sorted(batch), *runs)
+        visited = self.segments[-2:] if self.reversible else self.segments
+        count = self.add_layer(difference(candidates, merge_unique(*visited)))
+        for run in runs:
+            run.close()
+            os.remove(run.path)
+        return count
+
+    def run(self, max_layers: Optional[int] = None, max_time: Optional[float] = None) -> KLExploration:
+        '''Compute the layers until no new position is found, or max_layers layers are computed,
+        or max_time seconds have passed. Call it again to continue an incomplete search.'''
+        t0 = time.perf_counter()
+        nb = 0
+        while not self.result.complete:
+            if max_layers is not None and nb >= max_layers:
+                break
+            if max_time is not None and time.perf_counter() - t0 > max_time:
+                break
+            if not self.next_layer():
+                self.result.complete = True
+                self.save_manifest()
+            nb += 1
+        self.result.elapsed += time.perf_counter() - t0
+        return self.result
+
+    def distance(self, state: int) -> int:
+        '''Return the distance from the start to a state, -1 if it was not reached'''
+        key = self.layout.key(state)
+        for d, seg in enumerate(self.segments):
+            if key in seg:
+                return d
+        return -1
+
+    def close(self) -> None:
+        for seg in self.segments:
+            seg.close()
+        self.segments = []
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Explore all the positions of a level, storing them on disk')
+    parser.add_argument('name', help='name of the level to explore')
+    parser.add_argument('directory', help='directory of the files, the search resumes if it already contains one')
+    parser.add_argument('--boards', default=str(pathlib.Path(__file__).parent / "boards.kts"),
+                        help='board file, boards.kts by default')
+    parser.add_argument('--metric', choices=['steps', 'moves'], default='steps')
+    parser.add_argument('--run-size', type=int, default=1 << 20, help='number of positions sorted in memory')
+    parser.add_argument('--max-time', type=float, default=None, help='stop after the layer running at that time')
+    args = parser.parse_args()
+
+    maps = [m for m in load_maps(args.boards).values() if m.name == args.name]
+    if not maps:
+        parser.error('No level named %s' % args.name)
+    search = KLDiskSearch(maps[0], args.directory, getattr(Metric, args.metric), args.run_size)
+    r = search.run(max_time=args.max_time)
+    search.close()
+    print(
+        "%-30s positions=%d winning=%d depth=%d first_win=%d complete=%s time=%.2fs"
+        % (r.name, r.positions, r.winning, r.depth, r.first_win, r.complete, r.elapsed)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ License: Gnu GPL (see fname LICENSE)
 '''
 
 
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Mapping, Sequence
 import sys, pathlib
 
 if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
@@ -26,38 +26,74 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QWidget,
     QSizePolicy,
+    QFileDialog,
+    QInputDialog,
 )
 from PyQt5.QtGui import QIcon, QPixmap
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import QTimer, Qt
 
 from .kl_enum import *
-from .kl_map import load_maps, KLMap
+from .kl_model import KLMove, KLPosition, merge_moves, build_move, level_of, model_from_level
+from .kl_map import KLMap
+from .kl_catalog import KLCatalog
 from .kl_board import KLBoard
 from .kl_board_chooser import KLBoardChooser, KlMinimapProvider
+from .kl_hint import KLHintEngine
+from .kl_replay import REPLAY_SUFFIX, read_replay, write_replay
+from .kl_snapshot import KLSnapshot, SNAPSHOT_SUFFIX, read_snapshot, write_snapshot
+from .kl_autosave import KLAutosave, autosave_fname
+
+# time between two moves when playing a replay, in milliseconds
+REPLAY_INTERVAL = 400
+
+# the position is kept every CHECKPOINT_INTERVAL moves of the move list, for jump_to()
+CHECKPOINT_INTERVAL = 128
 
 
 def reverse_move(d: Tuple[int, int]) -> Tuple[int, int]:
     return (-d[0], -d[1])
 
 
+def sum_steps(steps: Sequence[Tuple[str, Tuple[int, int]]]) -> Tuple[str, Tuple[int, int]]:
+    '''Return the entry of the move list made of these steps of the same piece'''
+    if len(steps) == 1:
+        return steps[0]
+    return steps[0][0], (sum(d[0] for _, d in steps), sum(d[1] for _, d in steps))
+
+
 class Klotski(QMainWindow):
-    def __init__(self, maps: Dict[int, KLMap], firstBoard: Optional[int] = None) -> None:
+    def __init__(self, maps: Mapping[int, KLMap], firstBoard: Optional[int] = None) -> None:
         QMainWindow.__init__(self)
         self.klmap = None  # type: Optional[KLMap]
         self.moves = 0
         self.move_list = []  # type: List[ Tuple[str, Tuple[int, int]]]
+        # changes of the board for each entry of move_list, to undo and redo them. After a snapshot
+        # is restored, they are None until first needed, see move_delta().
+        self.move_deltas = []  # type: List[Optional[KLMove]]
+        # s_walls removed by the entries of move_list, by index, for the entries removing some
+        self.s_walls_removed = {}  # type: Dict[int, Tuple[Tuple[int, int], ...]]
+        # steps of one cell of each entry of move_list, to save replays
+        self.move_steps = []  # type: List[List[Tuple[str, Tuple[int, int]]]]
         self.move_index = -1
-        self.mini_maps_dict = {}  # type: Dict[int, QPixmap]
+        # position after some entries of move_list, by index, -1 for the start of the level
+        self.checkpoints = {}  # type: Dict[int, KLPosition]
         self.levels_by_id = maps
+        self.autosave = KLAutosave(autosave_fname())
 
         self.init_misc_gui()
 
         self.board.load_tiles()
         self.board.sig_move.connect(self.move_tile)
 
-        self.generate_mini_maps()
+        self.hint_engine = KLHintEngine(self)
+        self.hint_engine.sig_hint.connect(self.play_hint)
+
+        # plays the moves of move_list after move_index, one by one
+        self.replay_timer = QTimer(self)
+        self.replay_timer.setInterval(REPLAY_INTERVAL)
+        self.replay_timer.timeout.connect(self.replay_next)
 
-        self.board_chooser = KLBoardChooser(KlMinimapProvider(self.levels_by_id, self.mini_maps_dict), self)
+        self.board_chooser = KLBoardChooser(KlMinimapProvider(self.levels_by_id, self.board), self)
         self.board_chooser.hide()
 
         # needs self.board
@@ -111,11 +147,6 @@ class Klotski(QMainWindow):
 
         self.adjustSize()
 
-    def generate_mini_maps(self) -> None:
-        self.mini_maps_dict = {}
-        for i in self.levels_by_id.keys():
-            self.mini_maps_dict[i] = self.board.generate_mini_map(self.levels_by_id[i])
-
     def new_level(self, m: KLMap) -> None:
         '''Display a new map into the main window'''
         if m.name != NAME_SPLASH_SCREEN:
@@ -174,6 +205,8 @@ class Klotski(QMainWindow):
     def init_menu(self) -> None:
         file_menu = QMenu('Game', self)
         file_menu.addAction("Boards", self.choose_board, Qt.CTRL + Qt.Key_B)
+        file_menu.addAction("Load game", self.open_game)
+        file_menu.addAction("Save game", self.save_game)
         file_menu.addAction("Quit", self.close, Qt.CTRL + Qt.Key_X)  # type: ignore
         file_menu.addAction("About Klotski", self.about)
 
@@ -181,10 +214,18 @@ class Klotski(QMainWindow):
         move_menu.addAction("Reset", self.reset)
         move_menu.addAction("Undo", self.undo, Qt.CTRL + Qt.Key_U)
         move_menu.addAction("Redo", self.redo, Qt.CTRL + Qt.Key_R)
+        move_menu.addAction("Hint", self.hint, Qt.CTRL + Qt.Key_H)
+
+        replay_menu = QMenu('Replay', self)
+        replay_menu.addAction("Open replay", self.open_replay, Qt.CTRL + Qt.Key_O)
+        replay_menu.addAction("Save replay", self.save_replay, Qt.CTRL + Qt.Key_S)
+        replay_menu.addAction("Play / Pause", self.play_replay, Qt.CTRL + Qt.Key_P)
+        replay_menu.addAction("Go to move", self.go_to_move, Qt.CTRL + Qt.Key_G)
 
         main_menu = self.menuBar()
         main_menu.addMenu(file_menu)
         main_menu.addMenu(move_menu)
+        main_menu.addMenu(replay_menu)
 
     def set_move_nb(self, m: int) -> None:
         self.move_lcd_nb.display(m)
@@ -196,38 +237,87 @@ class Klotski(QMainWindow):
             return
 
         assert self.klmap
-        self.klmap.move_piece(pid, delta)
+        self.hint_engine.cancel()
+        self.replay_timer.stop()
+        self.record_move(pid, delta)
         self.board.move_piece(pid, delta)
 
-        if self.move_index < 0:
-            self.move_list = [(pid, (0, 0))]
-            self.move_index = 0
-            self.set_move_nb(self.moves + 1)
-
-        last_move_pid, last_move = self.move_list[self.move_index]
-
-        if pid != last_move_pid:
-            self.move_index = self.move_index + 1
-            self.move_list[self.move_index:] = [(pid, delta)]
-            self.set_move_nb(self.moves + 1)
-        else:
-            self.move_list[self.move_index:] = [(pid, (last_move[0] + delta[0], last_move[1] + delta[1]))]
-
         if self.klmap.is_game_won():
             QMessageBox.information(
                 self, "Congratulation", "Congratulations!!!\nYou completed this level in %d moves" % self.moves
             )
             self.move_enabled = False
             self.klmap.reset()
+            self.autosave.save(None)
+            return
+        self.save_state()
+
+    def record_move(self, pid: str, delta: Tuple[int, int]) -> None:
+        '''Move the piece pid by one cell on the map, and add the move to the move list'''
+        assert self.klmap
+        # consecutive moves of the same piece count as one move
+        merged = self.move_index >= 0 and self.move_list[self.move_index][0] == pid
+
+        # the positions after the entries replaced or changed are no longer valid
+        stale = self.move_index if merged else self.move_index + 1
+        for i in [i for i in self.checkpoints if i >= stale]:
+            del self.checkpoints[i]
+        if not merged and (self.move_index + 1) % CHECKPOINT_INTERVAL == 0:
+            # the entry at move_index is complete
+            self.checkpoints[self.move_index] = self.klmap.position()
+
+        if merged:
+            # needs the piece at its place after the current entry, see move_delta()
+            last_delta = self.move_delta(self.move_index)
+        move = self.klmap.move_piece(pid, delta)
+        if merged:
+            last_move = self.move_list[self.move_index][1]
+            move = merge_moves(last_delta, move)
+            self.move_list[self.move_index:] = [(pid, (last_move[0] + delta[0], last_move[1] + delta[1]))]
+            self.move_deltas[self.move_index:] = [move]
+            self.move_steps[self.move_index:] = [self.move_steps[self.move_index] + [(pid, delta)]]
+        else:
+            self.move_index = self.move_index + 1
+            self.move_list[self.move_index:] = [(pid, delta)]
+            self.move_deltas[self.move_index:] = [move]
+            self.move_steps[self.move_index:] = [[(pid, delta)]]
+            self.set_move_nb(self.moves + 1)
+
+        for i in [i for i in self.s_walls_removed if i >= self.move_index]:
+            del self.s_walls_removed[i]
+        if move.s_walls_removed:
+            self.s_walls_removed[self.move_index] = move.s_walls_removed
 
     def reset(self) -> None:
         assert self.klmap
+        self.hint_engine.cancel()
+        self.replay_timer.stop()
         self.klmap.reset()
         self.board.set_map(self.klmap)
         self.set_move_nb(0)
         self.move_enabled = True
         self.move_list = []
+        self.move_deltas = []
+        self.s_walls_removed = {}
+        self.move_steps = []
         self.move_index = -1
+        self.checkpoints = {-1: self.klmap.position()}
+        self.save_state()
+
+    def move_delta(self, index: int) -> KLMove:
+        '''Return the changes of the board of the entry index of the move list, which must be the current
+        entry or the next one'''
+        assert self.klmap
+        move = self.move_deltas[index]
+        if move is None:
+            # restored from a snapshot: the piece is at its place before the next entry, after the current one
+            pid, (dx, dy) = self.move_list[index]
+            cells = tuple(self.klmap.piece_cells[pid])
+            if index == self.move_index:
+                cells = tuple((x - dx, y - dy) for (x, y) in cells)
+            move = build_move(pid, dx, dy, cells, self.s_walls_removed.get(index, ()))
+            self.move_deltas[index] = move
+        return move
 
     def undo(self) -> None:
         if self.move_index < 0:
@@ -239,11 +329,13 @@ class Klotski(QMainWindow):
         d = reverse_move(self.move_list[self.move_index][1])
         assert self.klmap
         assert self.board
-        self.klmap.move_piece(pid, d)
+        self.hint_engine.cancel()
+        self.klmap.revert_move(self.move_delta(self.move_index))
         self.board.move_piece(pid, d)
         self.set_move_nb(self.moves - 1)
 
         self.move_index = self.move_index - 1
+        self.save_state()
 
     def redo(self) -> None:
         if self.move_index + 1 >= len(self.move_list):
@@ -251,13 +343,185 @@ class Klotski(QMainWindow):
         if not self.move_enabled:
             return
 
-        self.move_index = self.move_index + 1
-        pid, d = self.move_list[self.move_index]
         assert self.klmap
         assert self.board
-        self.klmap.move_piece(pid, d)
+        self.hint_engine.cancel()
+        self.klmap.apply_move(self.move_delta(self.move_index + 1))
+        self.move_index = self.move_index + 1
+        pid, d = self.move_list[self.move_index]
         self.board.move_piece(pid, d)
         self.set_move_nb(self.moves + 1)
+        self.save_state()
+
+    def jump_to(self, index: int) -> None:
+        '''Go back or forward in the move list to the position after the move index, -1 for the start
+        of the level. The board shows it at once, without sliding the pieces.'''
+        if not self.move_enabled:
+            return
+        assert self.klmap
+        index = max(-1, min(index, len(self.move_list) - 1))
+        self.hint_engine.cancel()
+        # start from the closest position kept before index, if it is closer than the current one
+        closest = max(i for i in self.checkpoints if i <= index)
+        if index - closest < abs(index - self.move_index):
+            self.klmap.set_position(self.checkpoints[closest])
+            self.move_index = closest
+        while self.move_index > index:
+            self.klmap.revert_move(self.move_delta(self.move_index))
+            self.move_index = self.move_index - 1
+        while self.move_index < index:
+            self.klmap.apply_move(self.move_delta(self.move_index + 1))
+            self.move_index = self.move_index + 1
+        self.board.update_scene()
+        self.set_move_nb(self.move_index + 1)
+        self.save_state()
+
+    def snapshot(self) -> KLSnapshot:
+        '''Return the snapshot of the game'''
+        assert self.klmap
+        return KLSnapshot(
+            level_of(self.klmap),
+            self.klmap.position(),
+            self.move_index,
+            tuple(self.move_steps),
+            dict(self.s_walls_removed),
+        )
+
+    def restore(self, snapshot: KLSnapshot) -> None:
+        '''Come back to the game of a snapshot, without playing its moves'''
+        self.new_level(model_from_level(snapshot.level, KLMap))
+        assert self.klmap
+        self.klmap.set_position(snapshot.position)
+        self.move_list = [sum_steps(steps) for steps in snapshot.move_steps]
+        self.move_deltas = [None] * len(self.move_list)
+        self.s_walls_removed = dict(snapshot.s_walls_removed)
+        self.move_steps = [list(steps) for steps in snapshot.move_steps]
+        self.move_index = snapshot.move_index
+        self.checkpoints[self.move_index] = snapshot.position
+        self.board.update_scene()
+        self.set_move_nb(self.move_index + 1)
+        self.save_state()
+
+    def save_state(self) -> None:
+        '''Save the game in the background, to resume it on the next launch'''
+        if self.klmap is None or self.klmap.name == NAME_SPLASH_SCREEN:
+            return
+        self.autosave.save(self.snapshot())
+
+    def resume(self) -> None:
+        '''Come back to the game saved automatically, if any'''
+        try:
+            snapshot = read_snapshot(self.autosave.fname)
+        except (OSError, ValueError):
+            return
+        self.restore(snapshot)
+
+    def open_game(self) -> None:
+        fname, _ = QFileDialog.getOpenFileName(self, "Load game", "", "Klotski games (*%s)" % SNAPSHOT_SUFFIX)
+        if not fname:
+            return
+        try:
+            snapshot = read_snapshot(fname)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Game", "Could not read the game:\n%s" % e)
+            return
+        self.replay_timer.stop()
+        self.restore(snapshot)
+
+    def save_game(self) -> None:
+        if self.klmap is None or self.klmap.name == NAME_SPLASH_SCREEN:
+            return
+        fname, _ = QFileDialog.getSaveFileName(self, "Save game", "", "Klotski games (*%s)" % SNAPSHOT_SUFFIX)
+        if not fname:
+            return
+        if not fname.endswith(SNAPSHOT_SUFFIX):
+            fname += SNAPSHOT_SUFFIX
+        try:
+            write_snapshot(fname, self.snapshot())
+        except (OSError, ValueError, OverflowError) as e:
+            QMessageBox.warning(self, "Game", "Could not save the game:\n%s" % e)
+
+    def find_level(self, digest: str) -> Optional[KLMap]:
+        '''Return the level with this digest, or None if there is none'''
+        for level_id in self.levels_by_id:
+            if self.levels_by_id[level_id].digest == digest:
+                return self.levels_by_id[level_id]
+        return None
+
+    def open_replay(self) -> None:
+        fname, _ = QFileDialog.getOpenFileName(self, "Open replay", "", "Klotski replays (*%s)" % REPLAY_SUFFIX)
+        if fname:
+            self.load_replay(fname)
+
+    def load_replay(self, fname: str) -> None:
+        '''Load the level of the replay file fname with its moves, ready to be played from the start'''
+        try:
+            digest, name, steps = read_replay(fname)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Replay", "Could not read the replay:\n%s" % e)
+            return
+        m = self.find_level(digest)
+        if m is None:
+            QMessageBox.warning(self, "Replay", "The level %s of this replay was not found." % name)
+            return
+
+        self.new_level(m)
+        for pid, delta in steps:
+            if pid not in m.piece_cells or delta not in m.possibleMove(pid):
+                self.reset()
+                QMessageBox.warning(self, "Replay", "This replay contains an impossible move.")
+                return
+            self.record_move(pid, delta)
+        self.jump_to(-1)
+
+    def save_replay(self) -> None:
+        if not self.move_list:
+            return
+        assert self.klmap
+        fname, _ = QFileDialog.getSaveFileName(self, "Save replay", "", "Klotski replays (*%s)" % REPLAY_SUFFIX)
+        if not fname:
+            return
+        if not fname.endswith(REPLAY_SUFFIX):
+            fname += REPLAY_SUFFIX
+        try:
+            write_replay(fname, self.klmap.digest, self.klmap.name, [s for steps in self.move_steps for s in steps])
+        except OSError as e:
+            QMessageBox.warning(self, "Replay", "Could not save the replay:\n%s" % e)
+
+    def play_replay(self) -> None:
+        '''Start or stop playing the moves of the move list after the current one'''
+        if self.replay_timer.isActive():
+            self.replay_timer.stop()
+        elif self.move_index + 1 < len(self.move_list):
+            self.replay_timer.start()
+
+    def replay_next(self) -> None:
+        self.redo()
+        if self.move_index + 1 >= len(self.move_list):
+            self.replay_timer.stop()
+
+    def go_to_move(self) -> None:
+        '''Show at once the position after a move of the move list chosen by the player'''
+        if not self.move_list:
+            return
+        n, ok = QInputDialog.getInt(self, "Go to move", "Move:", self.moves, 0, len(self.move_list))
+        if ok:
+            self.replay_timer.stop()
+            self.jump_to(n - 1)
+
+    def hint(self) -> None:
+        '''Ask for the next move towards the solution, it is played when found'''
+        if not self.move_enabled:
+            return
+        assert self.klmap
+        self.hint_engine.request(self.klmap)
+
+    def play_hint(self, steps: List[Tuple[str, Tuple[int, int]]]) -> None:
+        if not steps:
+            QMessageBox.information(self, "Hint", "No move towards the solution was found from this position.")
+            return
+        for step in steps:
+            self.move_tile(step)
 
     def about(self) -> None:
         QMessageBox.about(self, 'About Klotski', MSG_ABOUT)
@@ -278,25 +542,25 @@ def main() -> None:
         path_boards_kts = pathlib.Path(__file__).parent / "boards.kts"
 
     QApplication.setWindowIcon(klotski_icon)
-    maps = load_maps(str(path_boards_kts))
+    maps = KLCatalog([str(path_boards_kts)], KLMap)
 
     firstBoard = None
     if len(sys.argv) > 1:
         firstBoardName = sys.argv[1]
-        for m in maps.keys():
-            if maps[m].name == firstBoardName:
-                firstBoard = m
-                break
-        else:
+        firstBoard = maps.find(firstBoardName)
+        if firstBoard is None:
             print("No such map: ", firstBoardName)
             print('Map List:')
-            for m in maps:
-                print(maps[m].name)
+            for name in maps.names:
+                print(name)
 
     klotski = Klotski(maps, firstBoard)
     klotski.setWindowIcon(klotski_icon)
+    if firstBoard is None:
+        klotski.resume()
     klotski.show()
     a.exec()
+    klotski.autosave.wait()
     del klotski
 
 
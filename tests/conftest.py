@@ -0,0 +1,46 @@
+'''
+Fixtures of the tests: the board file, and a Qt application for the tests of the GUI.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Iterator
+import os, sys, shutil, pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+BOARDS_KTS = pathlib.Path(__file__).parent.parent / 'src' / 'boards.kts'
+
+
+@pytest.fixture
+def boards(tmp_path: pathlib.Path) -> str:
+    '''A copy of boards.kts, so that its index and cache files are not written in the source tree'''
+    fname = str(tmp_path / 'boards.kts')
+    shutil.copy(str(BOARDS_KTS), fname)
+    return fname
+
+
+@pytest.fixture(scope='session')
+def qapp() -> Iterator[object]:
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])
+    yield app
+
+
+@pytest.fixture
+def klotski(qapp: object, boards: str, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[object]:
+    '''The main window on the splash screen, with its automatic save and minimaps in tmp_path'''
+    from src.klotski import Klotski
+    from src.kl_catalog import KLCatalog
+    from src.kl_map import KLMap
+
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path / 'data'))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    k = Klotski(KLCatalog([boards], KLMap), None)
+    yield k
+    k.autosave.wait()
+    k.deleteLater()
@@ -0,0 +1,42 @@
+'''
+Tests of KLModel: moving pieces, undoing and redoing moves.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from src.kl_enum import Piece
+from src.kl_model import KLModel, parse_maps, merge_moves
+
+DOOR_LEVEL = '''
+<Door>
+@#**#@
+@#  #@
+@#--#@
+@#  #@
+@#  #@
+@#..#@
+'''
+
+
+def door_level() -> KLModel:
+    return parse_maps(DOOR_LEVEL.splitlines(), KLModel)[0]
+
+
+def test_revert_move_through_s_wall() -> None:
+    m = door_level()
+    move = m.move_piece(Piece.heart, (0, 1))
+    for _ in range(2):
+        move = merge_moves(move, m.move_piece(Piece.heart, (0, 1)))
+    # the heart went past the s_walls, which are neither vacated nor occupied by the merged move
+    assert move.s_walls_removed == ((1, 2), (2, 2))
+    assert m.s_wall == []
+    assert ''.join(m.xymap[2]) == '#  #'
+
+    m.revert_move(move)
+    assert sorted(m.s_wall) == [(1, 2), (2, 2)]
+    assert m.xymap == m.orig_xymap
+
+    m.apply_move(move)
+    assert m.s_wall == []
+    assert ''.join(m.xymap[2]) == '#  #'
+    assert ''.join(m.xymap[3]) == '#**#'
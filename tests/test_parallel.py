@@ -0,0 +1,36 @@
+'''
+Tests of the exploration of the levels with several processes.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+import pytest
+
+from src.kl_model import load_maps
+from src.kl_state import KLLayout
+from src.kl_solver import Metric
+from src.kl_parallel import KLParallelExplorer, explore
+
+
+def level(boards: str, name: str):  # type: ignore
+    maps = load_maps(boards)
+    return next(m for m in maps.values() if m.name == name)
+
+
+def test_explore(boards: str) -> None:
+    r = explore(level(boards, 'Easy'), nb_workers=2)
+    assert r.complete
+    assert r.positions > 1
+    assert r.winning > 0
+    assert r.first_win > 0
+
+
+def test_worker_failure(boards: str) -> None:
+    layout = KLLayout(level(boards, 'Easy'))
+    with KLParallelExplorer(2) as explorer:
+        # the first worker fails, the second one waits for its states
+        explorer.commands[0].put(('level', None, Metric.steps))
+        explorer.commands[1].put(('level', layout, Metric.steps))
+        with pytest.raises(RuntimeError, match='Worker 0 failed'):
+            explorer.run_layer()
+    assert not any(p.is_alive() for p in explorer.processes)
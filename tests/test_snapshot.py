@@ -0,0 +1,43 @@
+'''
+Tests of the snapshots of a game: saving, restoring and playing on after a restore.
+
+Author: Philippe Fremy
+License: Gnu GPL (see fname LICENSE)
+'''
+from typing import Any
+
+from src.kl_snapshot import pack_snapshot, unpack_snapshot
+
+
+def restored(k: Any) -> None:
+    '''Restore the game of k from the bytes of its snapshot'''
+    k.restore(unpack_snapshot(pack_snapshot(k.snapshot())))
+
+
+def start_level(k: Any, name: str) -> None:
+    k.new_level(k.levels_by_id[k.levels_by_id.find(name)])
+
+
+def test_restore_position(klotski: Any) -> None:
+    start_level(klotski, 'Easy')
+    klotski.record_move('k', (1, 0))
+    klotski.record_move('g', (0, 1))
+    position, move_list = klotski.klmap.position(), list(klotski.move_list)
+    restored(klotski)
+    assert klotski.klmap.position() == position
+    assert klotski.move_list == move_list
+    assert klotski.moves == 2
+
+
+def test_merge_after_restore(klotski: Any) -> None:
+    start_level(klotski, 'Easy')
+    start = klotski.klmap.position()
+    klotski.record_move('k', (1, 0))
+    restored(klotski)
+    # the second step of k is merged with the restored entry
+    klotski.record_move('k', (1, 0))
+    assert klotski.move_list == [('k', (2, 0))]
+    klotski.undo()
+    assert klotski.klmap.position() == start
+    klotski.redo()
+    assert ''.join(klotski.klmap.xymap[7]) == '  #  kl#  '